@@ -0,0 +1,79 @@
+#!/usr/bin/python
+
+import os, json
+import numpy as np
+from expressions import Jagged
+
+# columnar copy of the ljmet branches used by the analysis, one .npy file per branch that is memory-mapped on read
+# collection branches are stored as <branch>.counts.npy and <branch>.content.npy
+# the manifest is written last, so a cache without one ( i.e. an interrupted extraction ) is never read
+
+def column_dir( cacheDir, samplePath ):
+  shift = os.path.basename( os.path.dirname( os.path.abspath( samplePath ) ) ) # nominal, JECup, ...
+  return os.path.join( cacheDir, "columns", shift, os.path.basename( samplePath ).replace( ".root", "" ) )
+
+def column_file( path, branch, part = None ):
+  return os.path.join( path, "{}.npy".format( branch if part is None else branch + "." + part ) )
+
+def source_stats( samplePath ):
+  # path, size and modification time, checked on every read without reading the input
+  stat = os.stat( samplePath )
+  return { "PATH": os.path.abspath( samplePath ), "SIZE": stat.st_size, "MTIME": int( stat.st_mtime ) }
+
+def save_manifest( path, samplePath, nEntries, branches ):
+  # branches = { branch: "FLAT" or "JAGGED" }
+  manifest = { "SOURCE": source_stats( samplePath ), "ENTRIES": nEntries, "BRANCHES": branches }
+  tmpPath = os.path.join( path, "manifest.json.{}.tmp".format( os.getpid() ) )
+  with open( tmpPath, "w" ) as manifestFile:
+    json.dump( manifest, manifestFile, indent = 2, sort_keys = True )
+  os.rename( tmpPath, os.path.join( path, "manifest.json" ) )
+
+def load_manifest( path, samplePath ):
+  # the manifest of an up to date cache of samplePath, None if there is none
+  manifestPath = os.path.join( path, "manifest.json" )
+  if not os.path.exists( manifestPath ): return None
+  try:
+    with open( manifestPath ) as manifestFile:
+      manifest = json.load( manifestFile )
+  except ValueError:
+    print( "[WARN] Ignoring unreadable column cache manifest {}".format( manifestPath ) )
+    return None
+  stats = source_stats( samplePath )
+  if any( manifest[ "SOURCE" ].get( key ) != stats[ key ] for key in stats ): # caches written with a checksum stay valid
+    print( "[WARN] Column cache {} is out of date with {}, reading from ROOT instead".format( path, samplePath ) )
+    return None
+  return manifest
+
+def read_columns( path, manifest, branches, entries = None ):
+  # without entries the memory-mapped arrays are returned as they are, otherwise only the given entries are copied out
+  columns = {}
+  for branch in branches:
+    if manifest[ "BRANCHES" ][ branch ] == "JAGGED":
+      counts = np.load( column_file( path, branch, "counts" ), mmap_mode = "r" )
+      content = np.load( column_file( path, branch, "content" ), mmap_mode = "r" )
+      if entries is None:
+        columns[ branch ] = Jagged( counts, content )
+        continue
+      starts = np.cumsum( counts ) - counts
+      selected = counts[ entries ]
+      offsets = np.repeat( starts[ entries ] - ( np.cumsum( selected ) - selected ), selected )
+      columns[ branch ] = Jagged( selected, content[ offsets + np.arange( len( offsets ) ) ] )
+    else:
+      values = np.load( column_file( path, branch ), mmap_mode = "r" )
+      columns[ branch ] = values if entries is None else values[ entries ]
+  return columns
+
+def as_numpy( rdf, rTree, branches ):
+  # RDataFrame::AsNumpy of the branches in entry order, the entries arrive out of order with ImplicitMT
+  # collections are returned as Jagged, their counts are the sizes of the vectors read in the same event loop
+  collections = [ branch for branch in sorted( branches ) if rTree.GetBranch( branch ) and rTree.GetBranch( branch ).GetClassName().startswith( "vector" ) ]
+  for branch in collections: rdf = rdf.Define( "singleLep_size_" + branch, "{}.size()".format( branch ) )
+  arrays = rdf.AsNumpy( sorted( branches ) + [ "singleLep_size_" + branch for branch in collections ] + [ "rdfentry_" ] )
+  order = np.argsort( arrays[ "rdfentry_" ], kind = "stable" )
+  columns = {}
+  for branch in branches:
+    values = arrays[ branch ][ order ]
+    if branch in collections: columns[ branch ] = Jagged.from_objects( values, arrays[ "singleLep_size_" + branch ][ order ] )
+    elif values.dtype == object: columns[ branch ] = Jagged.from_objects( values ) # i.e. arrays with a leaf count
+    else: columns[ branch ] = values
+  return np.asarray( arrays[ "rdfentry_" ], dtype = np.int64 )[ order ], columns
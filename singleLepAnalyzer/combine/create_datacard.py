@@ -87,7 +87,8 @@ class DataCard():
     os.system( "cp -vp {} {}".format( self.templatePath, os.path.join( os.getcwd(), self.limitPath ) ) )
     
     templateFile = ROOT.TFile( os.path.join( self.limitPath, self.templateName ) )
-    self.hist_names = [ rKey.GetName() for rKey in templateFile.GetListOfKeys() if not hist_parse( rKey.GetName(), samples )[ "IS SYST" ] ]
+    if templateFile.Get( "PREVIEW" ): print( "[WARN] {} holds preview templates from {:.1f}% of the events, do not use them for results".format( self.templateName, 100. * templateFile.Get( "PREVIEW" ).GetVal() ) )
+    self.hist_names = [ rKey.GetName() for rKey in templateFile.GetListOfKeys() if rKey.GetName() != "PREVIEW" and not hist_parse( rKey.GetName(), samples )[ "IS SYST" ] ]
     
     self.categories = { "ALL": list( set( hist_name.split( "_" )[-2] for hist_name in self.hist_names if ( "isE" in hist_name.split( "_" )[-2] or "isM" in hist_name.split( "_" )[-2] ) ) ) }
     self.categories[ "ABCDNN" ] = [ category for category in self.categories[ "ALL" ] if hist_parse( category, self.samples )[ "ABCDNN" ] ]
@@ -9,6 +9,8 @@ inputDir = { year: "/isilon/hadoop/store/user/dali/FWLJMET106XUL_singleLep20{}UL
 
 siginputDir = { year: "/isilon/hadoop/store/group/bruxljmFWLJMET106XUL_singleLep20{}UL_RunIISummer20_{}_step2/".format( year, postfix ) for year in years }
 
+cacheDir = { year: "cache_UL{}".format( year ) for year in years } # selection masks written by hists.py and extracted branches, relative to makeTemplates/
+
 # target lumis in 1/pb for each year
 lumi = {
   "16APV": 19520., # from pdmv
@@ -40,6 +42,11 @@ options = {
     "RENORM PDF": True,        # renormalize the PDF weights
     "SUMMARY": False,          # produce summary templates
     "SCALE SIGNAL 1PB": False, # Scale the signal xsec to 1 PB for future studies
+    "CACHE SELECTION": True,   # store the selected events per sample and category, and the category bitmap index, in cacheDir
+    "COLUMN CACHE": True,      # read the branches extracted by makeTemplates/extract_columns.py from cacheDir when it is up to date
+    "PREFETCH DEPTH": 1,       # processes whose input files are read ahead in the background, 0 turns it off
+    "PREFETCH MB": 2048,       # cap on the data read ahead of the process being filled
+    "FINE BINS": 0,            # fill every variable in this many uniform bins over its range, templates.py sums them into the plot_params bins, 0 turns it off
   },
   "MODIFY BINNING": {
     "BLIND": True,                 #  
@@ -371,6 +378,13 @@ base_cut += "&& (theJetPt_JetSubCalc_PtOrdered[0]>{}) && (theJetPt_JetSubCalc_Pt
  
 #base_cut += " && AK4HT > {} && corr_met_MultiLepCalc > {} && MT_lepMet > {} && minDR_lepJet > 0.4".format( event_cuts[ "ht" ], event_cuts[ "met" ], event_cuts[ "mt" ] )
 #base_cut += " && DNN_1to40_3t > {}".format( event_cuts[ "dnn" ] )
+# event number hashed by hists.py --fraction to pick the same events in the nominal and shifted trees
+event_branch = "event_CommonCalc"
+# low-cardinality branches of the category cuts, hists.py keeps a bitmap index of their values per sample
+category_index = [ "isElectron", "isMuon", "NresolvedTops1pFake", "NJetsTtagged", "NJetsWtagged", "NJetsCSV_JetSubCalc", "NJets_JetSubCalc" ]
+category_index += [ "NJetsCSV_JetSubCalc_{}".format( shift ) for shift in [ "bSFup", "bSFdn", "lSFup", "lSFdn" ] ]
+category_index += [ "NresolvedTops1pFake_shifts[{}]".format(i) for i in range(6) ] + [ "NJetsTtagged_shifts[{}]".format(i) for i in range(6) ] + [ "NJetsWtagged_shifts[{}]".format(i) for i in range(8) ]
+
 mc_weight = "triggerXSF * triggerSF * pileupWeight * pileupJetIDWeight * lepIdSF * EGammaGsfSF * isoSF"
 mc_weight += " * ( MCWeight_MultiLepCalc / abs( MCWeight_MultiLepCalc ) )"
 
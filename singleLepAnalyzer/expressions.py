@@ -0,0 +1,305 @@
+#!/usr/bin/python
+
+import re
+import numpy as np
+
+# compiles the TTreeFormula cut and weight strings used in config.py and hists.py into a graph evaluated with numpy
+# identical subexpressions ( i.e. the trigger and lepton pT clauses of config.base_cut ) are stored and evaluated once
+
+binary_power = { # binding power of the binary operators, higher binds tighter
+  "||": 1,
+  "&&": 2,
+  "==": 3, "!=": 3,
+  "<": 4, "<=": 4, ">": 4, ">=": 4,
+  "+": 5, "-": 5,
+  "*": 6, "/": 6
+}
+unary_power = 7
+commutative = [ "||", "&&", "==", "!=", "+", "*" ]
+flipped = { "==": "==", "!=": "!=", "<": ">", "<=": ">=", ">": "<", ">=": "<=" }
+
+token_regex = re.compile( r"\s*(?:(\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)|([A-Za-z_]\w*(?:::[A-Za-z_]\w*)*\$?)|(&&|\|\||==|!=|<=|>=|[-+*/<>!(),\[\]]))" )
+
+def numeric( value ):
+  # TTreeFormula treats booleans as 0 or 1 in arithmetic
+  if isinstance( value, ( bool, np.bool_ ) ): return float( value )
+  if isinstance( value, np.ndarray ) and value.dtype == bool: return value.astype( np.float64 )
+  return value
+
+def arithmetic( operation ):
+  return lambda *args: operation( *[ numeric( arg ) for arg in args ] )
+
+def divide( numerator, denominator ):
+  # TTreeFormula returns 0 for a division by zero
+  numerator, denominator = numeric( numerator ), numeric( denominator )
+  nonzero = np.not_equal( denominator, 0 )
+  with np.errstate( divide = "ignore", invalid = "ignore" ):
+    return np.where( nonzero, np.true_divide( numerator, np.where( nonzero, denominator, 1 ) ), 0. )
+
+operations = {
+  "||": np.logical_or,
+  "&&": np.logical_and,
+  "==": np.equal,
+  "!=": np.not_equal,
+  "<": np.less,
+  "<=": np.less_equal,
+  ">": np.greater,
+  ">=": np.greater_equal,
+  "+": arithmetic( np.add ),
+  "-": arithmetic( np.subtract ),
+  "*": arithmetic( np.multiply ),
+  "/": divide,
+  "NEG": arithmetic( np.negative ),
+  "NOT": np.logical_not
+}
+
+functions = {
+  "abs": np.abs, "fabs": np.abs, "TMath::Abs": np.abs,
+  "sqrt": np.sqrt, "TMath::Sqrt": np.sqrt,
+  "exp": np.exp, "TMath::Exp": np.exp,
+  "log": np.log, "TMath::Log": np.log,
+  "log10": np.log10, "TMath::Log10": np.log10,
+  "pow": np.power, "TMath::Power": np.power,
+  "min": np.minimum, "TMath::Min": np.minimum,
+  "max": np.maximum, "TMath::Max": np.maximum,
+  "sin": np.sin, "TMath::Sin": np.sin,
+  "cos": np.cos, "TMath::Cos": np.cos,
+  "tanh": np.tanh, "TMath::TanH": np.tanh,
+  "atan2": np.arctan2, "TMath::ATan2": np.arctan2
+}
+
+def length( value ):
+  # Length$: elements of a collection in every event, 1 for a single value per event
+  if isinstance( value, Jagged ): return value.counts.astype( np.float64 )
+  return np.ones( np.shape( value ) ) if np.ndim( value ) > 0 else 1.
+
+def total( value ):
+  # Sum$: sum over the elements of a collection in every event
+  if isinstance( value, Jagged ): return np.bincount( np.repeat( np.arange( len( value ) ), value.counts ), weights = numeric( value.content ), minlength = len( value ) )
+  return numeric( value )
+
+reductions = { "Length$": length, "Sum$": total } # collection to a single value per event
+
+class Jagged( object ):
+  # variable length branch ( i.e. vector<double> ) stored as the per-event counts and the flattened content
+  def __init__( self, counts, content ):
+    self.counts = np.asarray( counts, dtype = np.int64 )
+    self.content = np.asarray( content )
+    self.starts = np.cumsum( self.counts ) - self.counts
+
+  @classmethod
+  def from_objects( cls, values, counts = None ):
+    # from the object array of per-event vectors returned by RDataFrame::AsNumpy, counts = their sizes if they were read along
+    # the vectors are concatenated through their array interface, without a python loop over the events
+    if counts is None: counts = np.fromiter( map( len, values ), dtype = np.int64, count = len( values ) )
+    content = np.concatenate( list( values ) + [ np.zeros(0) ] ).astype( np.float64 ) if len( values ) > 0 else np.zeros(0)
+    return cls( counts, content )
+
+  def __len__( self ):
+    return len( self.counts )
+
+  def rows( self ):
+    # [ event x element ] view of the content of a collection with the same length in every event ( i.e. the _shifts arrays ), None otherwise
+    if not hasattr( self, "table" ):
+      width = self.counts[0] if len( self.counts ) > 0 else 0
+      self.table = self.content.reshape( len( self.counts ), width ) if width > 0 and np.all( self.counts == width ) else None
+    return self.table
+
+  def index( self, i ):
+    # the i-th element of every event, NaN where the event has fewer elements
+    # every index of a fixed-length collection is a strided view of the same content, so it is read and copied once
+    if self.rows() is not None:
+      return self.table[ :, i ] if i < self.table.shape[1] else np.full( len( self.counts ), np.nan )
+    values = np.full( len( self.counts ), np.nan )
+    has = self.counts > i
+    values[ has ] = self.content[ self.starts[ has ] + i ]
+    return values
+
+  def select( self, mask ):
+    return Jagged( self.counts[ mask ], self.content[ np.repeat( mask, self.counts ) ] )
+
+  def broadcast( self, values ):
+    # repeat per-event values for every element
+    if np.ndim( values ) == 0: return values
+    return np.repeat( values, self.counts )
+
+def apply( operation, *args ):
+  # elementwise operation, per-event values are broadcast to the elements of a collection
+  jagged = [ arg for arg in args if isinstance( arg, Jagged ) ]
+  if not jagged: return operation( *args )
+  for arg in jagged[1:]:
+    if not np.array_equal( arg.counts, jagged[0].counts ):
+      raise ValueError( "[ERR] Cannot combine collections of different lengths" )
+  return Jagged( jagged[0].counts, operation( *[ arg.content if isinstance( arg, Jagged ) else jagged[0].broadcast( arg ) for arg in args ] ) )
+
+def select( value, mask ):
+  # keep the events passing mask, constants are broadcast to the selected events
+  if isinstance( value, Jagged ): return value.select( mask )
+  if np.ndim( value ) == 0: return np.full( np.count_nonzero( mask ), numeric( value ), dtype = np.float64 )
+  return np.asarray( value )[ mask ]
+
+def tokenize( expression ):
+  tokens = []
+  position = 0
+  expression = expression.rstrip()
+  while position < len( expression ):
+    match = token_regex.match( expression, position )
+    if match is None:
+      raise ValueError( "[ERR] Unexpected '{}' at position {} in: {}".format( expression[ position: position + 10 ].strip(), position, expression ) )
+    number, name, op = match.groups()
+    if number is not None: tokens.append( ( "NUMBER", float( number ) ) )
+    elif name is not None: tokens.append( ( "NAME", name ) )
+    else: tokens.append( ( "OP", op ) )
+    position = match.end()
+  tokens.append( ( "END", None ) )
+  return tokens
+
+class Compiler( object ):
+  # every node is a tuple ( op, arguments ) stored once, so a subexpression shared by several cuts is a single node
+  def __init__( self ):
+    self.nodes = []
+    self.ids = {}
+    self.compiled = {}
+
+  def node( self, op, *args ):
+    if op in commutative: args = tuple( sorted( args ) )
+    key = ( op, ) + tuple( args )
+    if key not in self.ids:
+      self.ids[ key ] = len( self.nodes )
+      self.nodes.append( key )
+    return self.ids[ key ]
+
+  def compile( self, expression ):
+    if expression not in self.compiled:
+      self.tokens, self.position = tokenize( expression ), 0
+      root = self.parse( 0 )
+      if self.tokens[ self.position ][0] != "END":
+        raise ValueError( "[ERR] Unexpected '{}' in: {}".format( self.tokens[ self.position ][1], expression ) )
+      self.compiled[ expression ] = root
+    return self.compiled[ expression ]
+
+  def next( self ):
+    token = self.tokens[ self.position ]
+    self.position += 1
+    return token
+
+  def expect( self, op ):
+    token = self.next()
+    if token != ( "OP", op ): raise ValueError( "[ERR] Expected '{}' but found '{}'".format( op, token[1] ) )
+
+  def parse( self, power ):
+    left = self.prefix()
+    while True:
+      kind, value = self.tokens[ self.position ]
+      if kind != "OP" or value not in binary_power or binary_power[ value ] <= power: return left
+      self.position += 1
+      left = self.node( value, left, self.parse( binary_power[ value ] ) )
+
+  def prefix( self ):
+    kind, value = self.next()
+    if kind == "NUMBER": return self.node( "CONST", value )
+    if kind == "NAME":
+      if self.tokens[ self.position ] == ( "OP", "(" ):
+        if value not in functions and value not in reductions: raise ValueError( "[ERR] Unsupported function: {}".format( value ) )
+        self.position += 1
+        args = [ self.parse( 0 ) ]
+        while self.tokens[ self.position ] == ( "OP", "," ):
+          self.position += 1
+          args.append( self.parse( 0 ) )
+        self.expect( ")" )
+        return self.node( "CALL", value, *args )
+      operand = self.node( "BRANCH", value )
+      while self.tokens[ self.position ] == ( "OP", "[" ):
+        self.position += 1
+        index = self.nodes[ self.parse( 0 ) ]
+        if index[0] != "CONST": raise ValueError( "[ERR] Only constant indices are supported for {}".format( value ) )
+        self.expect( "]" )
+        operand = self.node( "INDEX", operand, int( index[1] ) )
+      return operand
+    if ( kind, value ) == ( "OP", "(" ):
+      operand = self.parse( 0 )
+      self.expect( ")" )
+      return operand
+    if ( kind, value ) == ( "OP", "-" ):
+      operand = self.parse( unary_power )
+      if self.nodes[ operand ][0] == "CONST": return self.node( "CONST", -self.nodes[ operand ][1] )
+      return self.node( "NEG", operand )
+    if ( kind, value ) == ( "OP", "+" ): return self.parse( unary_power )
+    if ( kind, value ) == ( "OP", "!" ): return self.node( "NOT", self.parse( unary_power ) )
+    raise ValueError( "[ERR] Unexpected '{}'".format( value ) )
+
+  def children( self, id_ ):
+    node = self.nodes[ id_ ]
+    if node[0] in [ "CONST", "BRANCH" ]: return []
+    if node[0] == "INDEX": return [ node[1] ]
+    if node[0] == "CALL": return list( node[2:] )
+    return list( node[1:] )
+
+  def branches( self, expressions ):
+    # names of the branches read by the expressions
+    return self.node_branches( [ self.compile( expression ) for expression in expressions ] )
+
+  def node_branches( self, ids ):
+    names, seen = set(), set()
+    stack = list( ids )
+    while stack:
+      id_ = stack.pop()
+      if id_ in seen: continue
+      seen.add( id_ )
+      if self.nodes[ id_ ][0] == "BRANCH": names.add( self.nodes[ id_ ][1] )
+      stack.extend( self.children( id_ ) )
+    return names
+
+  def conjuncts( self, expression ):
+    # top-level clauses of a && chain
+    clauses, stack = [], [ self.compile( expression ) ]
+    while stack:
+      id_ = stack.pop()
+      if self.nodes[ id_ ][0] == "&&": stack.extend( self.nodes[ id_ ][1:] )
+      else: clauses.append( id_ )
+    return clauses
+
+  def column( self, id_ ):
+    # name of a branch or of a constant index of a branch, i.e. NJetsWtagged_shifts[1]
+    node = self.nodes[ id_ ]
+    if node[0] == "BRANCH": return node[1]
+    if node[0] == "INDEX" and self.nodes[ node[1] ][0] == "BRANCH": return "{}[{}]".format( self.nodes[ node[1] ][1], node[2] )
+    return None
+
+  def comparison( self, id_ ):
+    # ( column, op, constant ) for a clause comparing a column to a constant, None for any other clause
+    node = self.nodes[ id_ ]
+    if node[0] not in flipped: return None
+    for column, constant, op in [ ( node[1], node[2], node[0] ), ( node[2], node[1], flipped[ node[0] ] ) ]:
+      if self.column( column ) is not None and self.nodes[ constant ][0] == "CONST":
+        return self.column( column ), op, self.nodes[ constant ][1]
+    return None
+
+  def evaluate( self, expressions, columns, cache = None ):
+    # cache holds the value of every evaluated node and can be shared between calls on the same columns
+    if cache is None: cache = {}
+    return { expression: self.value( self.compile( expression ), columns, cache ) for expression in expressions }
+
+  def value( self, id_, columns, cache ):
+    if id_ in cache: return cache[ id_ ]
+    node = self.nodes[ id_ ]
+    if node[0] == "CONST":
+      result = node[1]
+    elif node[0] == "BRANCH":
+      result = columns[ node[1] ]
+    elif node[0] == "INDEX":
+      operand = self.value( node[1], columns, cache )
+      if isinstance( operand, Jagged ):
+        result = operand.index( node[2] )
+      elif np.ndim( operand ) == 2:
+        result = operand[ :, node[2] ] if node[2] < operand.shape[1] else np.full( len( operand ), np.nan )
+      else:
+        raise ValueError( "[ERR] Cannot index a branch with a single value per event: {}".format( self.nodes[ node[1] ][1] ) )
+    elif node[0] == "CALL" and node[1] in reductions:
+      result = reductions[ node[1] ]( self.value( node[2], columns, cache ) )
+    elif node[0] == "CALL":
+      result = apply( arithmetic( functions[ node[1] ] ), *[ self.value( arg, columns, cache ) for arg in node[2:] ] )
+    else:
+      result = apply( operations[ node[0] ], *[ self.value( arg, columns, cache ) for arg in node[1:] ] )
+    cache[ id_ ] = result
+    return result
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+
+import os, sys, time, json
+from argparse import ArgumentParser
+
+sys.path.append( os.path.dirname( "../" ) )
+
+from utils import sample_paths, sample_manifest_path, load_sample_manifest
+from selection import selection_path, load_entries
+import config
+
+# records the existence, size, ljmet entries and base cut entries of every input file in cacheDir/samples.json
+# hists.py and condor_templates.py read it instead of probing the shared filesystem, run it again whenever the inputs change
+
+parser = ArgumentParser()
+parser.add_argument( "-y", "--year", default = "17" )
+parser.add_argument( "-g", "--groups", nargs = "+", default = [ "DAT", "BKG", "SIG" ] )
+args = parser.parse_args()
+
+if args.year == "16APV":
+  import samplesUL16APV as samples
+elif args.year == "16":
+  import samplesUL16 as samples
+elif args.year == "17":
+  import samplesUL17 as samples
+elif args.year == "18":
+  import samplesUL18 as samples
+else:
+  quit( "[ERR] Invalid -y (--year) option used. Quitting..." )
+
+import ROOT
+
+ROOT.gROOT.SetBatch(1)
+
+def scan( samplePath ):
+  if not os.path.exists( samplePath ): return { "EXISTS": False }
+  stat = os.stat( samplePath )
+  rFile = ROOT.TFile.Open( samplePath, "READ" )
+  rTree = rFile.Get( "ljmet" )
+  nEntries = rTree.GetEntries()
+  # the entry list of skim.py is used when it is up to date, otherwise the base cut is evaluated here
+  entries = load_entries( selection_path( config.cacheDir[ args.year ], samplePath, [ config.base_cut ], "skim" ), nEntries )
+  nPassed = len( entries ) if entries is not None else rTree.GetEntries( config.base_cut )
+  rFile.Close()
+  return { "EXISTS": True, "SIZE": stat.st_size, "MTIME": int( stat.st_mtime ), "ENTRIES": nEntries, "PASSED": nPassed }
+
+def main():
+  manifestPath = sample_manifest_path( args.year )
+  manifest = load_sample_manifest( args.year )
+  for group in args.groups:
+    group_time = time.time()
+    print( "[START] Scanning the {} inputs".format( group ) )
+    for samplePath in sample_paths( samples, args.year, group ):
+      manifest[ samplePath ] = scan( samplePath )
+      if manifest[ samplePath ][ "EXISTS" ]: print( "  + {}: {} entries, {} pass the base cut".format( samplePath, manifest[ samplePath ][ "ENTRIES" ], manifest[ samplePath ][ "PASSED" ] ) )
+      else: print( "[WARN] {} does not exist".format( samplePath ) )
+    print( "[DONE] Finished scanning {} in {:.2f} minutes".format( group, ( time.time() - group_time ) / 60. ) )
+  if not os.path.exists( os.path.dirname( manifestPath ) ): os.system( "mkdir -p {}".format( os.path.dirname( manifestPath ) ) )
+  tmpPath = "{}.{}.tmp".format( manifestPath, os.getpid() )
+  with open( tmpPath, "w" ) as manifestFile:
+    json.dump( manifest, manifestFile, indent = 2, sort_keys = True )
+  os.rename( tmpPath, manifestPath )
+  print( "[OK] Wrote {} ({} of {} inputs missing)".format( manifestPath, len( [ path for path in manifest if not manifest[ path ][ "EXISTS" ] ] ), len( manifest ) ) )
+
+main()
@@ -1,6 +1,6 @@
 #!/usr/bin/python
 
-import os,sys,datetime,itertools
+import os,sys,math,datetime,itertools
 from argparse import ArgumentParser
 sys.path.append( "../" )
 sys.path.append( "../singleLepAnalyzer/" )
@@ -12,43 +12,106 @@ parser.add_argument( "-y", "--year", required = True, help = "[16,17,18]" )
 parser.add_argument( "-v", "--variables", nargs = "+", required = True )
 parser.add_argument( "-p", "--postfix", default = "test" )
 parser.add_argument( "-r", "--region", required = True, help = "[SR,PS,TTCR,WJCR]" )
+parser.add_argument( "--regionJobs", action = "store_true", help = "submit one job per variable that fills every category of the region in one pass" )
+parser.add_argument( "--fraction", default = "1", help = "preview fraction of the events passed to hists.py --fraction" )
+parser.add_argument( "--workers", default = 1, type = int, help = "cores requested per job, passed to hists.py --workers" )
+parser.add_argument( "--shardSize", default = 0, type = int, help = "fill samples with more entries than this in shards of about this many entries, merged by reduce_shards.py" )
 args = parser.parse_args()
 
 thisDir = os.getcwd()
 
-if args.region == "TTCR": 
-  bins = config.hist_bins[ "VR" ]
-elif args.region == "WJCR":
-  bins = config.hist_bins[ "VR" ]
-elif args.region == "SR":
-  bins = config.hist_bins[ "SR" ]
-elif args.region == "VR":
-  bins = config.hist_bins[ "VR" ]
-elif args.region == "BASELINE":
-  bins = config.hist_bins[ "BASELINE" ]
-elif args.region == "ABCDNN":
-  bins = config.hist_bins[ "ABCDNN" ]
-else:
+if args.region not in [ "TTCR", "WJCR", "SR", "VR", "BASELINE", "ABCDNN" ]:
   quit( "[ERR] Invalid region argument used. Quitting." )
 
-categories = list(
-  itertools.product(
-    bins[ "LEPTON" ],
-    bins[ "NHOT" ],
-    bins[ "NT" ],
-    bins[ "NW" ],
-    bins[ "NB" ],
-    bins[ "NJ" ]
-  )
-)
+categories = utils.region_categories( args.region )
 	
 subDir = "{}_UL{}_{}".format( config.region_prefix[ args.region ], args.year, args.postfix )
 outputPath = os.path.join( os.getcwd(), subDir )
 if not os.path.exists( outputPath ): os.system( "mkdir -vp {}".format( outputPath ) )
 
+shards = {} # process -> number of entry-range shards
+if args.shardSize > 0:
+  if args.year == "16APV":
+    import samplesUL16APV as samples
+  elif args.year == "16":
+    import samplesUL16 as samples
+  elif args.year == "17":
+    import samplesUL17 as samples
+  else:
+    import samplesUL18 as samples
+  import ROOT
+  sampleManifest = utils.load_sample_manifest( args.year ) # entries from build_manifest.py, the inputs it does not list are opened
+  for group in [ "DAT", "BKG", "SIG" ]:
+    for process, samplePath in zip( sorted( samples.samples[ group ] ), utils.sample_paths( samples, args.year, group, True ) ):
+      if samplePath in sampleManifest:
+        if not sampleManifest[ samplePath ][ "EXISTS" ]: continue
+        nEntries = sampleManifest[ samplePath ][ "ENTRIES" ]
+      else:
+        if not os.path.exists( samplePath ): continue
+        rFile = ROOT.TFile.Open( samplePath )
+        nEntries = rFile.Get( "ljmet" ).GetEntries()
+        rFile.Close()
+      if nEntries > args.shardSize:
+        shards[ process ] = int( math.ceil( float( nEntries ) / args.shardSize ) )
+        print( "[INFO] Splitting {} ({} entries) into {} shards".format( process, nEntries, shards[ process ] ) )
+
+# inputs listed as missing by build_manifest.py would only fail once the jobs run
+missing = [ samplePath for samplePath, sample in sorted( utils.load_sample_manifest( args.year ).items() ) if not sample[ "EXISTS" ] ]
+if missing:
+  for samplePath in missing: print( "[ERR] {} does not exist".format( samplePath ) )
+  quit( "[ERR] {} inputs are missing, fix them or run build_manifest.py again. Quitting...".format( len( missing ) ) )
+
+# the NumTrueHist integrals and the normalization table are built once here instead of in every job
+if os.system( "python hists.py -y {} --normalization".format( args.year ) ) != 0:
+  quit( "[ERR] hists.py --normalization failed, not submitting jobs against a stale or missing normalization table. Quitting..." )
+
+def submit_job( jobParams ):
+  jdf = open( "condor_step1_{}.job".format( jobParams[ "JOBNAME" ] ), "w" )
+  jdf.write(
+"""universe = vanilla
+Executable = %(EXEDIR)s/condor_templates.sh
+Should_Transfer_Files = YES
+WhenToTransferOutput = ON_EXIT
+request_memory = 5000
+request_cpus = %(WORKERS)s
+Output = condor_step1_%(JOBNAME)s.out
+Error = condor_step1_%(JOBNAME)s.err
+Log = condor_step1_%(JOBNAME)s.log
+JobBatchName = SLA_step1_%(YEAR)s_%(VARIABLE)s_%(POSTFIX)s
+Notification = Error
+Arguments = %(VARIABLE)s %(YEAR)s %(LEPTON)s %(NHOT)s %(NT)s %(NW)s %(NB)s %(NJ)s %(EXEDIR)s %(SUBDIR)s %(FRACTION)s %(WORKERS)s %(PROCESSES)s %(SKIP)s %(SHARD)s %(REGION)s
+Queue 1"""%jobParams
+  )
+  jdf.close()
+  os.system( "condor_submit condor_step1_{}.job".format( jobParams[ "JOBNAME" ] ) )
+
+def submit_jobs( jobParams ):
+  # the sharded samples are left out of the main job and each shard fills one entry range of one of them
+  submit_job( dict( jobParams, JOBNAME = jobParams[ "VARIABLE" ], WORKERS = args.workers, PROCESSES = "-", SKIP = ",".join( sorted( shards ) ) if shards else "-", SHARD = "-" ) )
+  for process in sorted( shards ):
+    for i in range( shards[ process ] ):
+      shard = "{}of{}".format( i, shards[ process ] )
+      submit_job( dict( jobParams, JOBNAME = "{}_{}_{}".format( jobParams[ "VARIABLE" ], process, shard ), WORKERS = 1, PROCESSES = process, SKIP = "-", SHARD = shard ) )
+  return 1 + sum( shards.values() )
+
 nJobs = 0
 for variable in args.variables:
   print( ">> Generating templates for {}".format( variable ) )
+  if args.regionJobs:
+    print( "  + One job for the {} categories of {}".format( len( categories ), args.region ) )
+    os.chdir( outputPath )
+    nJobs += submit_jobs( {
+      "VARIABLE": variable,
+      "YEAR": args.year,
+      "LEPTON": "-", "NHOT": "-", "NT": "-", "NW": "-", "NB": "-", "NJ": "-",
+      "EXEDIR": thisDir,
+      "SUBDIR": subDir,
+      "POSTFIX": args.postfix,
+      "FRACTION": args.fraction,
+      "REGION": args.region
+    } )
+    os.chdir( thisDir )
+    continue
   for category in categories:
     categoryTag = "is{}nHOT{}nT{}nW{}nB{}nJ{}".format( 
       category[0],
@@ -58,10 +121,6 @@ for variable in args.variables:
       category[4],
       category[5]
     )
-    if ( int(category[1][0]) + int(category[2][0]) + int(category[3][0]) + int(category[4][0]) ) > int(category[5][0]):
-      print( "[WARN] {} is not topologically possible, skipping...".format( categoryTag ) )
-      continue
-      
     if not os.path.exists( os.path.join( outputPath, categoryTag ) ): os.system( "mkdir -vp {}".format( os.path.join( outputPath, categoryTag ) ) )
     os.chdir( os.path.join( outputPath, categoryTag ) )
 
@@ -76,30 +135,15 @@ for variable in args.variables:
       "NJ": category[5],
       "EXEDIR": thisDir,
       "SUBDIR": subDir,
-      "POSTFIX": args.postfix
+      "POSTFIX": args.postfix,
+      "FRACTION": args.fraction,
+      "REGION": ""
     }
-
-    jdf = open( "condor_step1_{}.job".format( variable ), "w" )
-    jdf.write(
-"""universe = vanilla
-Executable = %(EXEDIR)s/condor_templates.sh
-Should_Transfer_Files = YES
-WhenToTransferOutput = ON_EXIT
-request_memory = 5000
-Output = condor_step1_%(VARIABLE)s.out
-Error = condor_step1_%(VARIABLE)s.err
-Log = condor_step1_%(VARIABLE)s.log
-JobBatchName = SLA_step1_%(YEAR)s_%(VARIABLE)s_%(POSTFIX)s
-Notification = Error
-Arguments = %(VARIABLE)s %(YEAR)s %(LEPTON)s %(NHOT)s %(NT)s %(NW)s %(NB)s %(NJ)s %(EXEDIR)s %(SUBDIR)s
-Queue 1"""%jobParams
-    )
-    jdf.close()
-    os.system( "condor_submit condor_step1_{}.job".format( variable ) )
+    nJobs += submit_jobs( jobParams )
     os.chdir( ".." )
-    nJobs += 1
     if config.options[ "GENERAL" ][ "TEST" ]: 
       print( "[OPT] Testing one job." )
       break
 
 print( "[DONE] Total jobs submitted: {}".format( nJobs ) )
+if shards: print( "[INFO] Run reduce_shards.py -sd {} once the jobs finish".format( subDir ) )
@@ -10,6 +10,12 @@ nB=${7}
 nJ=${8}
 exeDir=${9}
 subDir=${10}
+fraction=${11}
+workers=${12}
+processes=${13}
+skip=${14}
+shard=${15}
+region=${16}
 condorDir=$PWD
 
 source /cvmfs/cms.cern.ch/cmsset_default.sh
@@ -17,13 +23,28 @@ source /cvmfs/cms.cern.ch/cmsset_default.sh
 cd $exeDir
 eval `scramv1 runtime -sh`
 
-python -u hists.py \
-  -v $variable \
-  -y $year \
-  -l $lepton \
-  -nh $nhot \
-  -nt $nT \
-  -nw $nW \
-  -nb $nB \
-  -nj $nJ \
-  -sd $subDir
+options="--fraction $fraction --workers $workers"
+if [ "$processes" != "-" ]; then options="$options --processes ${processes//,/ }"; fi
+if [ "$skip" != "-" ]; then options="$options --skip ${skip//,/ }"; fi
+if [ "$shard" != "-" ]; then options="$options --shard ${shard/of/ }"; fi
+
+if [ -n "$region" ]; then
+  python -u hists.py \
+    -v $variable \
+    -y $year \
+    -r $region \
+    -sd $subDir \
+    $options
+else
+  python -u hists.py \
+    -v $variable \
+    -y $year \
+    -l $lepton \
+    -nh $nhot \
+    -nt $nT \
+    -nw $nW \
+    -nb $nB \
+    -nj $nJ \
+    -sd $subDir \
+    $options
+fi
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+
+import os, sys, time
+import numpy as np
+from argparse import ArgumentParser
+
+sys.path.append( os.path.dirname( "../" ) )
+
+from utils import sample_paths
+from expressions import Compiler, Jagged
+from columns import column_dir, column_file, save_manifest, load_manifest, as_numpy
+import config
+
+# writes the ljmet branches read by hists.py into the columnar cache in config.cacheDir, run once per campaign of ntuples
+# hists.py memory-maps the cached branches and only reads the remaining ones through ROOT
+
+parser = ArgumentParser()
+parser.add_argument( "-y", "--year", default = "17" )
+parser.add_argument( "-g", "--groups", nargs = "+", default = [ "DAT", "BKG", "SIG" ] )
+parser.add_argument( "--nominal", action = "store_true", help = "only extract the nominal trees, not the JEC and JER shifted ones" )
+parser.add_argument( "--chunk", default = 500000, type = int, help = "entries read through ROOT at a time" )
+parser.add_argument( "--force", action = "store_true", help = "extract again even if the cache is up to date" )
+args = parser.parse_args()
+
+if args.year == "16APV":
+  import samplesUL16APV as samples
+elif args.year == "16":
+  import samplesUL16 as samples
+elif args.year == "17":
+  import samplesUL17 as samples
+elif args.year == "18":
+  import samplesUL18 as samples
+else:
+  quit( "[ERR] Invalid -y (--year) option used. Quitting..." )
+
+import ROOT
+
+ROOT.gROOT.SetBatch(1)
+
+def analysis_branches():
+  # branches of the cuts, weights, plot variables and shifts in config.py and of the weight systematics booked in hists.py
+  expressions = [ config.base_cut, config.mc_weight, config.event_branch ] + config.category_index
+  for variable in config.plot_params[ "VARIABLES" ]:
+    variableName = config.plot_params[ "VARIABLES" ][ variable ][0]
+    expressions += [ variableName, variableName + "_shifts" ]
+    abcdnnName = variableName + "_{}".format( config.params[ "ABCDNN" ][ "TAG" ] )
+    expressions += [ abcdnnName ] + [ abcdnnName + "_{}{}".format( syst, shift ) for syst in [ "MODEL", "CLOSURE" ] for shift in [ "UP", "DN" ] ]
+  expressions += [ "isTraining", "isHTgt500Njetge9", "topPtWeight13TeV", "renormWeights", "renormPSWeights", "pdfWeights" ]
+  expressions += [ "leptonEta_MultiLepCalc", "leptonPhi_MultiLepCalc" ]
+  expressions += [ "pileupWeightUp", "pileupWeightDown", "pileupJetIDWeightUp", "pileupJetIDWeightDown" ]
+  expressions += [ "L1NonPrefiringProb_CommonCalc", "L1NonPrefiringProbUp_CommonCalc", "L1NonPrefiringProbDown_CommonCalc" ]
+  expressions += [ "btagDeepJetWeight", "btagDeepJet2DWeight_HTnj" ]
+  for syst in [ "LF", "lfstats1", "lfstats2", "HF", "hfstats1", "hfstats2", "cferr1", "cferr2" ]:
+    for shift in [ "up", "dn" ]:
+      expressions += [ "btagDeepJetWeight_" + syst + shift, "btagDeepJet2DWeight_HTnj_" + syst + shift ]
+  return Compiler().branches( expressions )
+
+def extract( samplePath, branches ):
+  rFile = ROOT.TFile.Open( samplePath, "READ" )
+  rTree = rFile.Get( "ljmet" )
+  nEntries = rTree.GetEntries()
+  branches = sorted( branch for branch in branches if rTree.GetBranch( branch ) )
+  path = column_dir( config.cacheDir[ args.year ], samplePath )
+  manifest = load_manifest( path, samplePath )
+  if not args.force and manifest is not None and set( branches ) <= set( manifest[ "BRANCHES" ] ):
+    print( "  + {} is up to date".format( path ) )
+    return
+  if not os.path.exists( path ): os.system( "mkdir -p {}".format( path ) )
+  if os.path.exists( os.path.join( path, "manifest.json" ) ): os.remove( os.path.join( path, "manifest.json" ) )
+
+  # flat branches and the counts of collections are written in place, collection content is appended and converted at the end
+  kinds, arrays, contentFiles = {}, {}, {}
+  # each chunk filters an rdfentry_ range, so only the branches of the entries in range are read
+  rdf = ROOT.RDataFrame( rTree )
+  for start in range( 0, nEntries, args.chunk ):
+    stop = min( start + args.chunk, nEntries )
+    _, chunk = as_numpy( rdf.Filter( "rdfentry_ >= {} && rdfentry_ < {}".format( start, stop ) ), rTree, branches )
+    for branch in branches:
+      values = chunk[ branch ]
+      if branch not in kinds:
+        kinds[ branch ] = "JAGGED" if isinstance( values, Jagged ) else "FLAT"
+        if kinds[ branch ] == "JAGGED":
+          arrays[ branch ] = np.lib.format.open_memmap( column_file( path, branch, "counts" ), mode = "w+", dtype = np.int64, shape = ( nEntries, ) )
+          contentFiles[ branch ] = open( column_file( path, branch, "content" ) + ".raw", "wb" )
+        else:
+          arrays[ branch ] = np.lib.format.open_memmap( column_file( path, branch ), mode = "w+", dtype = values.dtype, shape = ( nEntries, ) )
+      if kinds[ branch ] == "JAGGED":
+        arrays[ branch ][ start:stop ] = values.counts
+        values.content.astype( np.float64 ).tofile( contentFiles[ branch ] )
+      else:
+        arrays[ branch ][ start:stop ] = values
+    print( "  + Read {}/{} entries".format( stop, nEntries ) )
+
+  for branch in arrays: arrays[ branch ].flush()
+  for branch in contentFiles:
+    contentFiles[ branch ].close()
+    rawPath = column_file( path, branch, "content" ) + ".raw"
+    content = np.memmap( rawPath, dtype = np.float64, mode = "r" ) if os.path.getsize( rawPath ) > 0 else np.zeros( 0 )
+    np.save( column_file( path, branch, "content" ), content )
+    del content
+    os.remove( rawPath )
+  save_manifest( path, samplePath, nEntries, kinds )
+  rFile.Close()
+
+def main():
+  branches = analysis_branches()
+  for group in args.groups:
+    group_time = time.time()
+    print( "[START] Extracting {} branches for {}".format( len( branches ), group ) )
+    for samplePath in sample_paths( samples, args.year, group, args.nominal ):
+      if not os.path.exists( samplePath ):
+        print( "[WARN] {} does not exist, skipping".format( samplePath ) )
+        continue
+      sample_time = time.time()
+      print( ">> Extracting {}".format( samplePath ) )
+      extract( samplePath, branches )
+      print( "[OK] Finished {} in {:.2f} minutes".format( os.path.basename( samplePath ), ( time.time() - sample_time ) / 60. ) )
+    print( "[DONE] Finished extracting {} in {:.2f} minutes".format( group, ( time.time() - group_time ) / 60. ) )
+
+main()
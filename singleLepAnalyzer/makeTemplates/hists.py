@@ -1,18 +1,23 @@
 #!/usr/bin/python
 
-import os, sys, time, math, datetime, pickle, itertools, getopt
+import os, sys, re, time, math, datetime, pickle, json, itertools, getopt, multiprocessing
 import numpy as np
 from array import array
 from argparse import ArgumentParser
 
 sys.path.append( os.path.dirname( "../" ) ) 
 
-from utils import contains_category, hist_tag
+from utils import contains_category, hist_tag, region_categories, load_sample_manifest
+from expressions import Compiler, Jagged, select
+from selection import BitmapIndex, CategoryCube, selection_path, load_selection, save_selection, load_entries, save_entries, preview_mask
+from columns import column_dir, load_manifest, read_columns, as_numpy
+from prefetch import Prefetcher, basket_path, load_baskets, save_baskets
 import config
-from xsec import xsec
+from normalization import build_table, load_table, save_table, table_path
+from weights import weight_ratio, shifted_weight, shift_weights
 
 parser = ArgumentParser()
-parser.add_argument( "-v", "--variable", default = "HT" )
+parser.add_argument( "-v", "--variables", nargs = "+", default = [ "HT" ], help = "variables in config.plot_params filled in the same pass, ALL for every variable" )
 parser.add_argument( "-y", "--year", default = "17" )
 parser.add_argument( "-l", "--lepton", default = "E" )
 parser.add_argument( "-nh", "--nhot", default = "0p" )
@@ -21,8 +26,22 @@ parser.add_argument( "-nw", "--nw", default = "0p" )
 parser.add_argument( "-nb", "--nb", default = "2p" )
 parser.add_argument( "-nj", "--nj", default = "5p" )
 parser.add_argument( "-sd", "--subDir", default = "test" )
+parser.add_argument( "-r", "--region", default = None, help = "fill every category of a region in config.hist_bins in one pass instead of the single category given by -l, -nh, -nt, -nw, -nb, -nj" )
+parser.add_argument( "--threads", default = 1, type = int, help = "ImplicitMT threads used in the event loop, 0 uses all available cores" )
+parser.add_argument( "--workers", default = 1, type = int, help = "processes filled in parallel, each in its own worker" )
+parser.add_argument( "--shiftWorkers", default = 1, type = int, help = "JEC and JER shifted trees of a process filled in parallel, each from its own TFile" )
+parser.add_argument( "--fraction", default = 1., type = float, help = "preview templates from this fraction of the events, picked by event number and scaled up by 1/fraction" )
+parser.add_argument( "--processes", nargs = "+", default = None, help = "only fill these processes, the output goes to <category>/shards/ for reduce_shards.py" )
+parser.add_argument( "--skip", nargs = "+", default = [], help = "processes filled by other ( shard ) jobs" )
+parser.add_argument( "--shard", nargs = 2, type = int, default = None, metavar = ( "INDEX", "COUNT" ), help = "only fill the INDEX-th of COUNT equal entry ranges of every tree" )
+parser.add_argument( "--normalization", action = "store_true", help = "only bring the NumTrueHist cache and the normalization table in cacheDir up to date, i.e. once before submitting the condor jobs" )
 args = parser.parse_args()
 
+if args.workers > 1 and args.threads != 1: quit( "[ERR] --workers cannot be combined with --threads, ImplicitMT does not survive the fork. Quitting..." )
+if args.shiftWorkers > 1 and ( args.workers > 1 or args.threads != 1 ): quit( "[ERR] --shiftWorkers cannot be combined with --workers or --threads. Quitting..." )
+if not 0 < args.fraction <= 1: quit( "[ERR] Invalid --fraction option used, must be in (0,1]. Quitting..." )
+if args.shard is not None and ( args.processes is None or not 0 <= args.shard[0] < args.shard[1] ): quit( "[ERR] Invalid --shard option used, requires --processes and 0 <= INDEX < COUNT. Quitting..." )
+
 if args.year == "16APV":
   import samplesUL16APV as samples 
 elif args.year == "16":
@@ -37,16 +56,31 @@ else:
 import ROOT
 
 ROOT.gROOT.SetBatch(1)
+if args.threads != 1: ROOT.EnableImplicitMT( args.threads )
+ROOT.gInterpreter.Declare( """
+#include <vector>
+namespace singleLep {
+  std::vector<char> selected;
+  void select_entries( const Long64_t* entries, Long64_t nSelected, Long64_t nEntries ){
+    selected.assign( nEntries, 0 );
+    for( Long64_t i = 0; i < nSelected; i++ ) selected[ entries[i] ] = 1;
+  }
+  bool is_selected( ULong64_t entry ){ return entry < selected.size() && selected[ entry ]; }
+}
+""" )
 start_time = time.time()
 
-category = {
-  "LEPTON": [ args.lepton ],
-  "NHOT": [ args.nhot ],
-  "NT": [ args.nt ],
-  "NW": [ args.nw ],
-  "NB": [ args.nb ],
-  "NJ": [ args.nj ]
-}
+variables = sorted( config.plot_params[ "VARIABLES" ] ) if args.variables == [ "ALL" ] else args.variables
+for variable in variables:
+  if variable not in config.plot_params[ "VARIABLES" ]: quit( "[ERR] {} is not in config.plot_params. Quitting...".format( variable ) )
+
+if args.region is None:
+  categoryBins = [ ( args.lepton, args.nhot, args.nt, args.nw, args.nb, args.nj ) ]
+elif args.region in [ "SR", "VR", "TTCR", "WJCR", "BASELINE", "ABCDNN" ]:
+  categoryBins = region_categories( args.region )
+else:
+  quit( "[ERR] Invalid -r (--region) option used. Quitting..." )
+categories = [ { "LEPTON": [ lepton ], "NHOT": [ nhot ], "NT": [ nt ], "NW": [ nw ], "NB": [ nb ], "NJ": [ nj ] } for lepton, nhot, nt, nw, nb, nj in categoryBins ]
 
 groups = {
   "DAT": sorted( [ str( process ) for process in samples.samples[ "DAT" ] ] ),
@@ -57,32 +91,384 @@ groups = {
   "TEST": [ str( process ) for process in samples.samples[ "TEST" ] ]
 }
 
+sampleManifest = load_sample_manifest( args.year )
+
+def missing_inputs( samplePaths ):
+  # inputs that do not exist according to build_manifest.py, the filesystem is only probed for the ones it does not list
+  return [ samplePath for samplePath in samplePaths if not ( sampleManifest[ samplePath ][ "EXISTS" ] if samplePath in sampleManifest else os.path.exists( samplePath ) ) ]
+
+def selected_processes( processes ):
+  return [ process for process in processes if ( args.processes is None or process in args.processes ) and process not in args.skip ]
+
+def shard_range( nEntries ):
+  # entries [ start, stop ) of a tree filled by this shard
+  if args.shard is None: return 0, nEntries
+  return nEntries * args.shard[0] // args.shard[1], nEntries * ( args.shard[0] + 1 ) // args.shard[1]
+
+def shard_tag():
+  return "" if args.shard is None else "shard{}of{}".format( args.shard[0], args.shard[1] )
+
+def category_tag( category ):
+  return "is{}nHOT{}nT{}nW{}nB{}nJ{}".format(
+    category[ "LEPTON" ][0], category[ "NHOT" ][0], category[ "NT" ][0],
+    category[ "NW" ][0], category[ "NB" ][0], category[ "NJ" ][0]
+  )
+
 def read_tree( samplePath ):
-  if not os.path.exists( samplePath ):
+  if missing_inputs( [ samplePath ] ):
     print("[ERR] {} does not exist.  Exiting program...".format( samplePath ) )
     sys.exit(1)
   rootFile = ROOT.TFile.Open( samplePath, "READ" )
+  if not rootFile or rootFile.IsZombie(): # the manifest says it exists, but it was removed or damaged since
+    print( "[ERR] {} cannot be opened, rebuild the sample manifest with build_manifest.py -y {}.  Exiting program...".format( samplePath, args.year ) )
+    sys.exit(1)
   rootTree = rootFile.Get( "ljmet" )
   return rootFile, rootTree
 
-def analyze( rTree, nHist, year, process, variable, doSYST, doPDF, doABCDNN, category, verbose ):
+def book( bookings, treeKey, histTag, variable, weight, cut, multiplier = None, shifted = None, replicas = None ):
+  bookings.append( {
+    "TREE": treeKey,        # key of the tree in rTree to fill from
+    "HIST": histTag,        # histogram to fill
+    "VARIABLE": variable,
+    "WEIGHT": weight,
+    "CUT": cut,
+    "MULTIPLIER": multiplier, # per-event factor applied to the evaluated weight, used for weight systematics
+    "SHIFTED": shifted,     # full shifted weight, used instead of the multiplier for events with a nominal weight of 0
+    "REPLICAS": replicas    # per-event weight multipliers, one y-bin of the [ bin x replica ] histogram each
+  } )
+
+maxCubeCells = 1 << 22 # cells ( including the variable bins ) of a category cube, about 100 MB for its three sums
+
+columnCaches = {} # input file -> ( directory, manifest ) of its columnar branch cache, None without an up to date cache
+
+def column_cache( rTree ):
+  samplePath = rTree.GetCurrentFile().GetName()
+  if samplePath not in columnCaches:
+    columnCaches[ samplePath ] = None
+    path = column_dir( config.cacheDir[ args.year ], samplePath )
+    manifest = load_manifest( path, samplePath ) if config.options[ "HISTS" ][ "COLUMN CACHE" ] else None
+    if manifest is not None and manifest[ "ENTRIES" ] == rTree.GetEntries():
+      print( "[INFO] Reading {} cached branches of {} from {}".format( len( manifest[ "BRANCHES" ] ), os.path.basename( samplePath ), path ) )
+      columnCaches[ samplePath ] = ( path, manifest )
+  return columnCaches[ samplePath ]
+
+def read_branches( rTree, branches, entries = None ):
+  # read the branches into numpy arrays ordered by entry number, restricted to the given entries if provided
+  # branches in the columnar cache written by extract_columns.py are memory-mapped, the rest are read through ROOT
+  cache = column_cache( rTree )
+  cached = set( branches ) & set( cache[1][ "BRANCHES" ] ) if cache is not None else set()
+  columns = {}
+  if cached:
+    if entries is None: entries = np.arange( rTree.GetEntries(), dtype = np.int64 )
+    columns = read_columns( cache[0], cache[1], cached, entries if len( entries ) < rTree.GetEntries() else None )
+    if cached == set( branches ): return entries, columns
+  entries, uncached = read_tree_branches( rTree, set( branches ) - cached, entries )
+  columns.update( uncached )
+  return entries, columns
+
+def read_tree_branches( rTree, branches, entries = None ):
+  # nothing to read, the entry numbers are known without an event loop
+  if not branches: return ( np.arange( rTree.GetEntries(), dtype = np.int64 ) if entries is None else np.asarray( entries, dtype = np.int64 ) ), {}
+  rdf = ROOT.RDataFrame( rTree )
+  if entries is not None:
+    ROOT.singleLep.select_entries( np.ascontiguousarray( entries, dtype = np.int64 ), len( entries ), rTree.GetEntries() )
+    rdf = rdf.Filter( "singleLep::is_selected( rdfentry_ )" )
+  entries, columns = as_numpy( rdf, rTree, branches )
+  for branch in columns:
+    if not isinstance( columns[ branch ], Jagged ): columns[ branch ] = columns[ branch ].astype( np.float64 )
+  return entries, columns
+
+def bin_index( values, variable, edges, nEvents, binned ):
+  # bin of every filled element of a variable and the event it belongs to, shared by every booking of the variable
+  # 0 is the underflow and len( edges ) the overflow, as in TAxis::FindBin
+  key = ( variable, edges )
+  if key not in binned:
+    value = values[ variable ]
+    if isinstance( value, Jagged ): # collection branches fill every element, as TTree::Draw does
+      events, value = np.repeat( np.arange( nEvents ), value.counts ), value.content
+    else:
+      events, value = np.arange( nEvents ), np.broadcast_to( value, ( nEvents, ) )
+    value = np.asarray( value, dtype = np.float64 )
+    keep = ~np.isnan( value ) # indexing past the end of a collection fills nothing
+    binned[ key ] = ( events[ keep ], np.digitize( value[ keep ], edges ) )
+  return binned[ key ]
+
+def fill_binned( hist, indx, weights ):
+  # every variation of a variable is a weighted bincount over the same bin index
+  nBins = hist.GetNbinsX() + 2
+  set_hist( hist, np.bincount( indx, weights = weights, minlength = nBins ), np.bincount( indx, weights = weights**2, minlength = nBins ), len( indx ) )
+
+def fill_matrix( hist, indx, weights, replicas ):
+  # fill a TH2D with the variable binning on x and one replica per y-bin
+  if len( indx ) == 0: return
+  nBinsX, nReplicas = hist.GetNbinsX(), hist.GetNbinsY()
+  flat = ( indx[ :, None ] + ( nBinsX + 2 ) * np.arange( nReplicas )[ None, : ] ).ravel()
+  replicaWeights = ( weights[ :, None ] * replicas ).ravel()
+  replicaWeights[ ~np.isfinite( replicaWeights ) ] = 0
+  sumw = np.bincount( flat, weights = replicaWeights, minlength = nReplicas * ( nBinsX + 2 ) ).reshape( nReplicas, nBinsX + 2 )
+  sumw2 = np.bincount( flat, weights = replicaWeights**2, minlength = nReplicas * ( nBinsX + 2 ) ).reshape( nReplicas, nBinsX + 2 )
+  # the replicas are the y-bins 1 to nReplicas of the [ ( nBinsY + 2 ) x ( nBinsX + 2 ) ] bin array
+  entries = hist.GetEntries()
+  contents, errors = hist_arrays( hist )
+  contents.reshape( -1, nBinsX + 2 )[ 1 : nReplicas + 1 ] += sumw
+  errors.reshape( -1, nBinsX + 2 )[ 1 : nReplicas + 1 ] += sumw2
+  hist.ResetStats()
+  hist.SetEntries( entries + len( indx ) * nReplicas )
+
+def skim_entries( compiler, rTree, verbose ):
+  # entries passing config.base_cut, from the entry list written by skim.py ( or by an earlier job ) when present
+  skimPath = selection_path( config.cacheDir[ args.year ], rTree.GetCurrentFile().GetName(), [ config.base_cut ], "skim" )
+  entries = load_entries( skimPath, rTree.GetEntries() )
+  if entries is not None:
+    if verbose: print( "  + Reusing the base cut skim of {} entries in {}".format( len( entries ), skimPath ) )
+    return entries
+  entries, values = read_branches( rTree, compiler.branches( [ config.base_cut ] ) )
+  entries = entries[ np.broadcast_to( compiler.evaluate( [ config.base_cut ], values )[ config.base_cut ], entries.shape ) != 0 ]
+  if config.options[ "HISTS" ][ "CACHE SELECTION" ]: save_entries( skimPath, rTree.GetEntries(), entries )
+  return entries
+
+def category_index( compiler, rTree, verbose ):
+  # bitmap index of the category branches over the entries passing the base cut, built once per input file
+  nEntries = rTree.GetEntries()
+  columns = [ column for column in config.category_index if rTree.GetBranch( column.split( "[" )[0] ) ]
+  if config.options[ "HISTS" ][ "CACHE SELECTION" ]:
+    indexPath = selection_path( config.cacheDir[ args.year ], rTree.GetCurrentFile().GetName(), [ config.base_cut ] + columns, "index" )
+    index = BitmapIndex.load( indexPath, nEntries )
+    if index is not None: return index
+  index_time = time.time()
+  entries = skim_entries( compiler, rTree, verbose )
+  values = {}
+  if len( entries ) > 0:
+    _, values = read_branches( rTree, compiler.branches( columns ), entries )
+    values = compiler.evaluate( columns, values )
+  index = BitmapIndex.build( nEntries, entries, values )
+  if config.options[ "HISTS" ][ "CACHE SELECTION" ]: index.save( indexPath )
+  if verbose: print( "  + Indexed {} category columns over {} entries ({:.2f} minutes)".format( len( index.bitmaps ), len( entries ), ( time.time() - index_time ) / 60. ) )
+  return index
+
+def select_events( compiler, rTree, cuts, verbose ):
+  # entries passing any of the cuts, the mask of each cut over those entries and the branches read to evaluate them
+  nEntries = rTree.GetEntries()
+  if config.options[ "HISTS" ][ "CACHE SELECTION" ]:
+    cachePath = selection_path( config.cacheDir[ args.year ], rTree.GetCurrentFile().GetName(), cuts, shard_tag() )
+    selection = load_selection( cachePath, nEntries, cuts )
+    if selection is not None:
+      if verbose: print( "  + Reusing the selection of {} entries in {}".format( len( selection[0] ), cachePath ) )
+      return selection[0], selection[1], {}
+
+  # clauses on the category branches are answered from the bitmap index with bitwise AND/OR, 
+  # the remaining clauses ( HEM veto, isTraining, ... ) are only evaluated for the entries the index leaves
+  if all( cut.startswith( config.base_cut ) for cut in cuts ):
+    index = category_index( compiler, rTree, verbose )
+    baseClauses = set( compiler.conjuncts( config.base_cut ) )
+  else:
+    index = BitmapIndex( nEntries, np.arange( nEntries, dtype = np.int64 ), {} )
+    baseClauses = set()
+  packed, residual = {}, {}
+  for cut in cuts:
+    packed[ cut ] = np.packbits( np.ones( len( index.entries ), dtype = bool ) )
+    residual[ cut ] = []
+    for clause in compiler.conjuncts( cut ):
+      if clause in baseClauses: continue
+      comparison = compiler.comparison( clause )
+      bitmap = index.packed( *comparison ) if comparison is not None else None
+      if bitmap is None: residual[ cut ].append( clause )
+      else: packed[ cut ] = np.bitwise_and( packed[ cut ], bitmap )
+  start, stop = shard_range( nEntries )
+  candidates = index.unpack( np.bitwise_or.reduce( [ packed[ cut ] for cut in cuts ] ) ) & ( index.entries >= start ) & ( index.entries < stop )
+  entries = index.entries[ candidates ]
+
+  columns = {}
+  branches = compiler.node_branches( [ clause for cut in cuts for clause in residual[ cut ] ] )
+  if len( entries ) > 0 and branches: _, columns = read_branches( rTree, branches, entries )
+  values, masks = {}, {}
+  for cut in cuts:
+    masks[ cut ] = index.unpack( packed[ cut ] )[ candidates ]
+    if len( entries ) == 0: continue
+    for clause in residual[ cut ]:
+      masks[ cut ] &= np.broadcast_to( compiler.value( clause, columns, values ), entries.shape ) != 0
+  union = np.logical_or.reduce( [ masks[ cut ] for cut in cuts ] )
+  entries = entries[ union ]
+  masks = { cut: masks[ cut ][ union ] for cut in cuts }
+  columns = { branch: select( columns[ branch ], union ) for branch in columns }
+  if config.options[ "HISTS" ][ "CACHE SELECTION" ]:
+    save_selection( cachePath, nEntries, entries, masks )
+  return entries, masks, columns
+
+def bin_buffer( buffer, nCells ):
+  # numpy view of the Double_t* of TH1::GetArray, sized as PyROOT and cppyy each expect
+  if hasattr( buffer, "SetSize" ): buffer.SetSize( nCells )
+  elif hasattr( buffer, "reshape" ): buffer = buffer.reshape( ( nCells, ) )
+  return np.frombuffer( buffer, dtype = np.float64, count = nCells )
+
+def hist_arrays( hist ):
+  # views of the bin contents and of the sums of squared weights of a TH1D or TH2D, including the under and overflow bins
+  if hist.GetSumw2N() == 0: hist.Sumw2()
+  return bin_buffer( hist.GetArray(), hist.GetNcells() ), bin_buffer( hist.GetSumw2().GetArray(), hist.GetNcells() )
+
+def set_hist( hist, sumw, sumw2, nFilled ):
+  # add per-bin sums of weights, including the under and overflow bins, to a TH1 in place of its bin arrays
+  entries = hist.GetEntries()
+  contents, errors = hist_arrays( hist )
+  contents += sumw
+  errors += sumw2
+  hist.ResetStats() # the statistics are recomputed from the bins, as after SetBinContent
+  hist.SetEntries( entries + nFilled )
+
+def hist_edges( hist ):
+  return tuple( hist.GetXaxis().GetBinLowEdge( i ) for i in range( 1, hist.GetNbinsX() + 2 ) )
+
+def booking_weights( compiler, columns, booking, values, nEvents, weighted ):
+  # per-event weight of a booking, computed once for every booking with the same weight and multiplier
+  key = ( booking[ "WEIGHT" ], booking[ "MULTIPLIER" ], booking[ "SHIFTED" ] )
+  if key not in weighted:
+    weights = np.array( np.broadcast_to( values[ booking[ "WEIGHT" ] ], ( nEvents, ) ), dtype = np.float64 )
+    if booking[ "MULTIPLIER" ] is not None:
+      weights = shift_weights( compiler, columns, weights, values[ booking[ "MULTIPLIER" ] ], booking[ "SHIFTED" ] )
+    weights[ ~np.isfinite( weights ) ] = 0 # indexing past the end of a weight vector fills nothing, as in TTree::Draw
+    weighted[ key ] = weights
+  return weighted[ key ]
+
+def split_cut( compiler, cut, baseClauses ):
+  # clauses of a cut on the category columns, as ( column, op, value ), and the ids of the remaining clauses
+  categoryClauses, residual = [], []
+  for clause in compiler.conjuncts( cut ):
+    if clause in baseClauses: continue
+    comparison = compiler.comparison( clause )
+    if comparison is not None and comparison[0] in config.category_index and comparison[1] in [ "==", ">=", ">" ] and comparison[2] >= 0 and float( comparison[2] ).is_integer():
+      categoryClauses.append( comparison )
+    else:
+      residual.append( clause )
+  return categoryClauses, tuple( sorted( residual ) )
+
+def fill_cube( compiler, columns, cache, values, nEvents, residual, cube, hists, binned, weighted ):
+  # fill one histogram per cell of the category columns and variable bin, every booking of the cube is then the sum over its cells
+  categoryCube = CategoryCube( [ clauses for booking, clauses in cube ] )
+  booking = cube[0][0]
+  hist = hists[ booking[ "HIST" ] ]
+  nBins = hist.GetNbinsX()
+  shape = categoryCube.shape + [ nBins + 2 ]
+  size = int( np.prod( shape ) )
+  if size > maxCubeCells: return False # the bookings are filled one by one instead
+  cells = categoryCube.cells( compiler, columns, cache, nEvents )
+  if cells is None: return False # only integer counts map onto slots
+  passed = np.ones( nEvents, dtype = bool )
+  for clause in residual: passed &= np.broadcast_to( compiler.value( clause, columns, cache ), ( nEvents, ) ) != 0
+
+  events, indx = bin_index( values, booking[ "VARIABLE" ], hist_edges( hist ), nEvents, binned )
+  passed = passed[ events ]
+  events, indx = events[ passed ], indx[ passed ]
+  weights = booking_weights( compiler, columns, booking, values, nEvents, weighted )[ events ]
+  flat = cells[ events ] * ( nBins + 2 ) + indx
+  sums = [ np.bincount( flat, weights = weights, minlength = size ).reshape( shape ),
+           np.bincount( flat, weights = weights**2, minlength = size ).reshape( shape ),
+           np.bincount( flat, minlength = size ).reshape( shape ) ]
+
+  for booking, clauses in cube:
+    selected = [ categoryCube.select( array, clauses ) for array in sums ]
+    set_hist( hists[ booking[ "HIST" ] ], selected[0], selected[1], int( selected[2].sum() ) )
+  return True
+
+def activate_branches( rTree, branches, maxCacheMB = 256 ):
+  # only the branches read by the bookings are enabled, TTreeCache is sized to hold one cluster of them
+  branches = [ branch for branch in sorted( branches ) if rTree.GetBranch( branch ) ]
+  rTree.SetBranchStatus( "*", 0 )
+  zipBytes = 0
+  for branch in branches:
+    rTree.SetBranchStatus( branch, 1 )
+    zipBytes += rTree.GetBranch( branch ).GetZipBytes( "*" )
+  nEntries = max( rTree.GetEntries(), 1 )
+  autoFlush = rTree.GetAutoFlush() # entries per cluster, or the compressed bytes per cluster if negative
+  clusterEntries = autoFlush if autoFlush > 0 else nEntries * float( -autoFlush ) / max( rTree.GetZipBytes(), 1 )
+  cacheBytes = int( 1.2 * zipBytes * min( clusterEntries, nEntries ) / nEntries )
+  rTree.SetCacheSize( min( max( cacheBytes, 1024**2 ), maxCacheMB * 1024**2 ) )
+  for branch in branches: rTree.AddBranchToCache( branch, True )
+  rTree.StopCacheLearningPhase()
+  return len( branches ), zipBytes
+
+def fill_bookings( rTree, bookings, hists, verbose, prefetcher = None ):
+  # cuts, weights and variables are compiled into one graph so clauses shared between bookings are evaluated once
+  compiler = Compiler()
+  for treeKey in sorted( set( booking[ "TREE" ] for booking in bookings ) ):
+    tree_time = time.time()
+    treeBookings = [ booking for booking in bookings if booking[ "TREE" ] == treeKey ]
+    expressions = set( booking[ key ] for booking in treeBookings for key in [ "VARIABLE", "WEIGHT" ] )
+    for booking in treeBookings:
+      if booking[ "MULTIPLIER" ] is not None: expressions.add( booking[ "MULTIPLIER" ] )
+      if booking[ "REPLICAS" ] is not None: expressions.update( booking[ "REPLICAS" ] )
+    cuts = sorted( set( booking[ "CUT" ] for booking in treeBookings ) )
+    shifted = set( booking[ "SHIFTED" ] for booking in treeBookings if booking[ "SHIFTED" ] is not None ) # only evaluated for events with a nominal weight of 0
+
+    # bookings differing only in their category clauses ( i.e. the categories of a region ) share one cube
+    baseClauses = set( compiler.conjuncts( config.base_cut ) ) if all( cut.startswith( config.base_cut ) for cut in cuts ) else set()
+    cubes = {}
+    for booking in treeBookings:
+      if booking[ "REPLICAS" ] is not None: continue
+      categoryClauses, residual = split_cut( compiler, booking[ "CUT" ], baseClauses )
+      # cut-shifted systematics ( i.e. NJetsCSV_JetSubCalc_bSFup ) cut on other columns and get a cube of their own
+      axes = tuple( sorted( set( clause[0] for clause in categoryClauses if clause[0] not in [ "isElectron", "isMuon" ] ) ) )
+      cubeKey = ( residual, axes, booking[ "VARIABLE" ], booking[ "WEIGHT" ], booking[ "MULTIPLIER" ], booking[ "SHIFTED" ], hist_edges( hists[ booking[ "HIST" ] ] ) )
+      if cubeKey not in cubes: cubes[ cubeKey ] = []
+      cubes[ cubeKey ].append( ( booking, categoryClauses ) )
+    cubes = { cubeKey: cubes[ cubeKey ] for cubeKey in cubes if len( cubes[ cubeKey ] ) > 1 }
+    cubeBranches = compiler.node_branches( [ clause for cubeKey in cubes for clause in cubeKey[0] ] )
+    cubeBranches |= compiler.branches( set( clause[0] for cubeKey in cubes for booking, clauses in cubes[ cubeKey ] for clause in clauses ) )
+
+    used = compiler.branches( list( expressions | shifted ) + cuts + [ config.base_cut, config.event_branch ] + config.category_index ) | cubeBranches
+    nActive, activeBytes = activate_branches( rTree[ treeKey ], used )
+    if config.options[ "HISTS" ][ "PREFETCH DEPTH" ] > 0: record_baskets( rTree[ treeKey ], used )
+    if prefetcher is not None: prefetcher.select( used ) # the next processes read the same branches
+    bytesRead = rTree[ treeKey ].GetCurrentFile().GetBytesRead()
+    if verbose: print( "  + Enabled {} of {} branches of {} ({:.1f} of {:.1f} MB compressed)".format( nActive, rTree[ treeKey ].GetListOfBranches().GetEntries(), treeKey, activeBytes / 1024.**2, rTree[ treeKey ].GetZipBytes() / 1024.**2 ) )
+
+    entries, masks, columns = select_events( compiler, rTree[ treeKey ], cuts, verbose )
+    if args.fraction < 1 and len( entries ) > 0:
+      _, events = read_branches( rTree[ treeKey ], [ config.event_branch ], entries )
+      keep = preview_mask( events[ config.event_branch ], args.fraction )
+      entries, masks = entries[ keep ], { cut: masks[ cut ][ keep ] for cut in masks }
+      columns = { branch: select( columns[ branch ], keep ) for branch in columns }
+    if len( entries ) == 0:
+      if verbose: print( "[WARN] No events in {} pass the selection".format( treeKey ) )
+      continue
+    _, remaining = read_branches( rTree[ treeKey ], ( compiler.branches( expressions | shifted ) | cubeBranches ) - set( columns ), entries )
+    columns.update( remaining )
+    cache = {}
+    values = compiler.evaluate( expressions, columns, cache )
+
+    # each variable is digitized once, every booking is then a bincount of its weights over the events passing its cut
+    filled, binned, weighted = set(), {}, {}
+    for cubeKey in cubes:
+      if fill_cube( compiler, columns, cache, values, len( entries ), cubeKey[0], cubes[ cubeKey ], hists, binned, weighted ):
+        filled.update( booking[ "HIST" ] for booking, clauses in cubes[ cubeKey ] )
+    for booking in treeBookings:
+      if booking[ "HIST" ] in filled: continue
+      hist = hists[ booking[ "HIST" ] ]
+      events, indx = bin_index( values, booking[ "VARIABLE" ], hist_edges( hist ), len( entries ), binned )
+      passed = masks[ booking[ "CUT" ] ][ events ]
+      events, indx = events[ passed ], indx[ passed ]
+      weights = booking_weights( compiler, columns, booking, values, len( entries ), weighted )[ events ]
+      if booking[ "REPLICAS" ] is not None:
+        replicas = np.column_stack( [ np.broadcast_to( np.asarray( values[ replica ], dtype = np.float64 ), ( len( entries ), ) )[ events ] for replica in booking[ "REPLICAS" ] ] )
+        fill_matrix( hist, indx, weights, replicas )
+      else:
+        fill_binned( hist, indx, weights )
+    if verbose: print( "  + Filled {} histograms ({} from {} category cubes) from {} events of {} ({:.2f} minutes, {:.1f} MB read)".format( len( treeBookings ), len( filled ), len( cubes ), len( entries ), treeKey, ( time.time() - tree_time ) / 60., ( rTree[ treeKey ].GetCurrentFile().GetBytesRead() - bytesRead ) / 1024.**2 ) )
+
+def analyze( rTree, normalization, year, process, variable, doSYST, doPDF, doABCDNN, category, bookings, verbose ):
+  # declares the histograms of one category and appends their bookings, filled afterwards by fill_bookings()
   variableName = config.plot_params[ "VARIABLES" ][ variable ][0]
   histBins = array( "d", config.plot_params[ "VARIABLES" ][ variable ][1] )
+  if config.options[ "HISTS" ][ "FINE BINS" ] > 0: # master histograms, rebinned to the plot_params bins by templates.py
+    histBins = array( "d", np.linspace( histBins[0], histBins[-1], config.options[ "HISTS" ][ "FINE BINS" ] + 1 ) )
   xLabel = config.plot_params[ "VARIABLES" ][ variable ][2]
   print( ">> Processing {} for 20{} {}".format( variable, year, process ) )
 
   
   # modify weights
-  # scale up MC samples used in DNN training where dataset partitioned into 60/20/20 so scale isTraining==1 || isTraining==3 by 1.25
-  mc_weights = { "NOMINAL": "1.25" if ( ( process.startswith( "TTTo" ) or process.startswith( "TTTW" ) or process.startswith( "TTTJ" ) ) and "DNN" in variable ) else "1" } # weights only applied to MC
-  if process in xsec:
-    nTrueHist = nHist[ process ]
-    for splitPrefix in samples.split:
-      if splitPrefix in process:
-        for splitProcess in samples.split[ splitPrefix ]:
-          if process != splitProcess: nTrueHist += nHist[ splitProcess ]
-        print( "[INFO] {} was hadded into more than one file, consolidating numTrueHist across split files: {} --> {}".format( process, nHist[ process ], nTrueHist ) )
-    mc_weights[ "PROCESS" ] = "( {:.2f} * {:.10f} / {:.1f} )".format( config.lumi[ args.year ], xsec[ process ], nTrueHist ) 
+  # lumi * xsec / NumTrueHist and the DNN training scale are looked up in the normalization table built in main()
+  mc_weights = { "NOMINAL": "{}".format( normalization[ process ][ "TRAINING" ] ) if ( process in normalization and "DNN" in variable ) else "1" } # weights only applied to MC
+  if process in normalization:
+    mc_weights[ "PROCESS" ] = "{:.12g}".format( normalization[ process ][ "FACTOR" ] )
   elif process in samples.samples[ "DAT" ]:
     mc_weights[ "PROCESS" ] = "1"
   else:
@@ -90,11 +476,9 @@ def analyze( rTree, nHist, year, process, variable, doSYST, doPDF, doABCDNN, cat
 
   if doABCDNN:
     abcdnnTag      = config.params[ "ABCDNN" ][ "TAG" ]
-    extABCDTF      = config.params[ "ABCDNN" ][ "TF" ][ args.year ]
-    extABCDTFScale = config.params[ "ABCDNN" ][ "TF SCALE" ]
     abcdnnName     = variableName + "_{}".format( abcdnnTag )
     print( "   + Including ABCDnn Histograms with tag {}".format( abcdnnTag ) )
-    mc_weights[ "ABCDNN" ] = "{} * {}".format( extABCDTF, extABCDTFScale, abcdnnTag ) 
+    mc_weights[ "ABCDNN" ] = "1" # the extended ABCD transfer factor is applied by templates.py, so changing it needs no refill
 
   if process.startswith( "TTTo" ): # https://twiki.cern.ch/twiki/bin/view/Sandbox/JamesKeaveneySandbox
     mc_weights[ "NOMINAL" ] += " * topPtWeight13TeV"
@@ -111,34 +495,37 @@ def analyze( rTree, nHist, year, process, variable, doSYST, doPDF, doABCDNN, cat
   if year in [ "16APV" ]: # since single lepton triggers weren't produced for EOY in 2016APV, default to triggerX
     mc_weights[ "NOMINAL" ] = mc_weights[ "NOMINAL" ].replace( "triggerSF", "1" )
    
+  # weight systematics are multipliers of the nominal weight, which is then only evaluated once per event
+  # shift_factors holds the ( nominal, shifted ) factors of the multipliers, their full shifted weight is kept in mc_shifted
+  shift_factors, mc_shifted = {}, {}
   if process not in groups[ "DAT" ] and doSYST:
     if config.systematics[ "MC" ][ "pileup" ][0]:
-      mc_weights[ "PILEUP" ] = { "UP": mc_weights[ "NOMINAL" ].replace( "pileupWeight", "pileupWeightUp" ),
-                                 "DN": mc_weights[ "NOMINAL" ].replace( "pileupWeight", "pileupWeightDown" ) }
+      shift_factors[ "PILEUP" ] = { "UP": [ ( "pileupWeight", "pileupWeightUp" ) ],
+                                    "DN": [ ( "pileupWeight", "pileupWeightDown" ) ] }
     if config.systematics[ "MC" ][ "pileupJetID" ][0]:
-      mc_weights[ "PILEUPJETID" ] = { "UP": mc_weights[ "NOMINAL" ].replace( "pileupJetIDWeight", "pileupJetIDWeightUp" ),
-                                      "DN": mc_weights[ "NOMINAL" ].replace( "pileupJetIDWeight", "pileupJetIDWeightDown" ) }
+      shift_factors[ "PILEUPJETID" ] = { "UP": [ ( "pileupJetIDWeight", "pileupJetIDWeightUp" ) ],
+                                         "DN": [ ( "pileupJetIDWeight", "pileupJetIDWeightDown" ) ] }
     if year in [ "16APV", "16", "17" ] and config.systematics[ "MC" ][ "prefire" ]:
-      mc_weights[ "PREFIRE" ] = { "UP": mc_weights[ "NOMINAL" ].replace("L1NonPrefiringProb_CommonCalc","L1NonPrefiringProbUp_CommonCalc"),
-                                  "DN": mc_weights[ "NOMINAL" ].replace("L1NonPrefiringProb_CommonCalc","L1NonPrefiringProbDown_CommonCalc") }
+      shift_factors[ "PREFIRE" ] = { "UP": [ ( "L1NonPrefiringProb_CommonCalc", "L1NonPrefiringProbUp_CommonCalc" ) ],
+                                     "DN": [ ( "L1NonPrefiringProb_CommonCalc", "L1NonPrefiringProbDown_CommonCalc" ) ] }
     if config.systematics[ "MC" ][ "muRFcorrd" ][0]:
-      mc_weights[ "MURFCORRD" ] = { "UP": "renormWeights[5] * {}".format( mc_weights[ "NOMINAL" ] ),
-                                    "DN": "renormWeights[3] * {}".format( mc_weights[ "NOMINAL" ] ) }
+      mc_weights[ "MURFCORRD" ] = { "UP": "renormWeights[5]",
+                                    "DN": "renormWeights[3]" }
     if config.systematics[ "MC" ][ "muR" ][0]:
-      mc_weights[ "MUR" ] = { "UP": "renormWeights[4] * {}".format( mc_weights[ "NOMINAL" ] ),
-                              "DN": "renormWeights[2] * {}".format( mc_weights[ "NOMINAL" ] ) }
+      mc_weights[ "MUR" ] = { "UP": "renormWeights[4]",
+                              "DN": "renormWeights[2]" }
     if config.systematics[ "MC" ][ "muF" ][0]:
-      mc_weights[ "MUF" ] = { "UP": "renormWeights[1] * {}".format( mc_weights[ "NOMINAL" ] ),
-                              "DN": "renormWeights[0] * {}".format( mc_weights[ "NOMINAL" ] ) }
+      mc_weights[ "MUF" ] = { "UP": "renormWeights[1]",
+                              "DN": "renormWeights[0]" }
     if config.systematics[ "MC" ][ "isr" ][0]: 
-      mc_weights[ "ISR" ] = { "UP": "renormPSWeights[0] * {}".format( mc_weights[ "NOMINAL" ] ),
-                              "DN": "renormPSWeights[2] * {}".format( mc_weights[ "NOMINAL" ] ) }
+      mc_weights[ "ISR" ] = { "UP": "renormPSWeights[0]",
+                              "DN": "renormPSWeights[2]" }
     if config.systematics[ "MC" ][ "fsr" ][0]:
-      mc_weights[ "FSR" ] = { "UP": "renormPSWeights[1] * {}".format( mc_weights[ "NOMINAL" ] ),
-                              "DN": "renormPSWeights[3] * {}".format( mc_weights[ "NOMINAL" ] ) }
+      mc_weights[ "FSR" ] = { "UP": "renormPSWeights[1]",
+                              "DN": "renormPSWeights[3]" }
     if config.systematics[ "MC" ][ "toppt" ][0]:
-      mc_weights[ "TOPPT" ] = { "UP": "({}) * {}".format( "topPtWeight13TeV" if "TTTo" in process else "1", mc_weights[ "NOMINAL" ] ),
-                                "DN": "(1/{}) * {}".format( "topPtWeight13TeV" if "TTTo" in process else "1", mc_weights[ "NOMINAL" ] ) }
+      mc_weights[ "TOPPT" ] = { "UP": "({})".format( "topPtWeight13TeV" if "TTTo" in process else "1" ),
+                                "DN": "(1/{})".format( "topPtWeight13TeV" if "TTTo" in process else "1" ) }
     if config.systematics[ "MC" ][ "ABCDNNMODEL" ][0] and doABCDNN and "ABCDNNMODEL" in config.params[ "ABCDNN" ][ "SYSTEMATICS" ]:
       mc_weights[ "ABCDNN ABCDNNMODEL" ] = { "UP": mc_weights[ "ABCDNN" ].replace( abcdnnName, abcdnnName + "_MODELUP" ), 
                                              "DN": mc_weights[ "ABCDNN" ].replace( abcdnnName, abcdnnName + "_MODELDN" ) }
@@ -149,9 +536,16 @@ def analyze( rTree, nHist, year, process, variable, doSYST, doPDF, doABCDNN, cat
     # deep jet related systematics
     for syst in [ "LF", "lfstats1", "lfstats2", "HF", "hfstats1", "hfstats2", "cferr1", "cferr2" ]:
       if config.systematics[ "MC" ][ syst ]:
-        mc_weights[ syst.upper() ] = {}
+        shift_factors[ syst.upper() ] = {}
         for shift in [ "up", "dn" ]:
-          mc_weights[ syst.upper() ][ shift.upper() ] = mc_weights[ "NOMINAL" ].replace( "btagDeepJetWeight", "btagDeepJetWeight_" + syst + shift ).replace( "btagDeepJet2DWeight_HTnj", "btagDeepJet2DWeight_HTnj_" + syst + shift )
+          shift_factors[ syst.upper() ][ shift.upper() ] = [
+            ( "btagDeepJetWeight", "btagDeepJetWeight_" + syst + shift ),
+            ( "btagDeepJet2DWeight_HTnj", "btagDeepJet2DWeight_HTnj_" + syst + shift )
+          ]
+
+    for syst in shift_factors:
+      mc_weights[ syst ] = { shift: weight_ratio( mc_weights[ "NOMINAL" ], shift_factors[ syst ][ shift ] ) for shift in shift_factors[ syst ] }
+      mc_shifted[ syst ] = { shift: shifted_weight( mc_weights[ "NOMINAL" ], shift_factors[ syst ][ shift ] ) for shift in shift_factors[ syst ] }
   
   # modify cuts
   cuts = { "BASE": config.base_cut }
@@ -200,10 +594,7 @@ def analyze( rTree, nHist, year, process, variable, doSYST, doPDF, doABCDNN, cat
     
   # declare histograms
   hists = {}
-  categoryTag = "is{}nHOT{}nT{}nW{}nB{}nJ{}".format(
-    category[ "LEPTON" ][0], category[ "NHOT" ][0], category[ "NT" ][0],
-    category[ "NW" ][0], category[ "NB" ][0], category[ "NJ" ][0]
-  )
+  categoryTag = category_tag( category )
   histTag = hist_tag( process, categoryTag )
   hists[ histTag ] = ROOT.TH1D( histTag, xLabel, len( histBins ) - 1, histBins )
   
@@ -228,13 +619,13 @@ def analyze( rTree, nHist, year, process, variable, doSYST, doPDF, doABCDNN, cat
             histTag = hist_tag( process, categoryTag, syst.upper() + shift )
             if syst.upper() == "PREFIRE" and year not in [ "16APV", "16", "17" ]: continue
             hists[ histTag ] = ROOT.TH1D( histTag, xLabel, len( histBins ) - 1, histBins )
-  if doPDF:
-    for i in range( config.params[ "GENERAL" ][ "PDF RANGE" ] ):
-      histTag = hist_tag( process, categoryTag, "PDF" + str(i) ) 
-      hists[ histTag ] = ROOT.TH1D( histTag, xLabel, len( histBins ) - 1, histBins )
-      if doABCDNN:
-        histTag = hist_tag( process, categoryTag, "ABCDNN", "PDF" + str(i) )
-        hists[ histTag ] = ROOT.TH1D( histTag, xLabel, len( histBins ) - 1, histBins )
+  if doPDF: # [ bin x replica ] matrix, unpacked into the PDF<i> histograms by utils.pdf_replicas()
+    nPDF = config.params[ "GENERAL" ][ "PDF RANGE" ]
+    histTag = hist_tag( process, categoryTag, "PDF" ) 
+    hists[ histTag ] = ROOT.TH2D( histTag, xLabel, len( histBins ) - 1, histBins, nPDF, 0, nPDF )
+    if doABCDNN:
+      histTag = hist_tag( process, categoryTag, "ABCDNN", "PDF" )
+      hists[ histTag ] = ROOT.TH2D( histTag, xLabel, len( histBins ) - 1, histBins, nPDF, 0, nPDF )
 
 
   # Sumw2() tells the hist to also store the sum of squares of weights
@@ -249,22 +640,12 @@ def analyze( rTree, nHist, year, process, variable, doSYST, doPDF, doABCDNN, cat
     if doABCDNN:
       print( ">> Applying ABCDnn cuts: {}".format( cuts[ "ABCDNN" ] ) )
 
-  # draw histograms
+  # book histograms, every booking on the same tree is filled in a single event loop
   histTag = hist_tag( process, categoryTag )
-  rTree[ process ].Draw( 
-    "{} >> {}".format( variableName, histTag ), 
-    "{} * ({})".format( mc_weights[ "NOMINAL" ], cuts[ "NOMINAL" ] ), 
-    "GOFF" )
-
-  if verbose: print( "  + NOMINAL: {} --> {}".format( rTree[ process ].GetEntries(), hists[ histTag ].Integral() ) )
+  book( bookings, process, histTag, variableName, mc_weights[ "NOMINAL" ], cuts[ "NOMINAL" ] )
 
   if doABCDNN:
-    rTree[ process ].Draw(
-      "{} >> {}".format( abcdnnName, hist_tag( process, categoryTag, "ABCDNN" ) ),
-      "{} * ({})".format( mc_weights[ "ABCDNN" ], cuts[ "ABCDNN" ] ),
-      "GOFF"
-    )
-    if verbose: print( "  + ABCDNN: {} --> {}".format( rTree[ process ].GetEntries(), hists[ hist_tag( process, categoryTag, "ABCDNN" ) ].Integral() ) )
+    book( bookings, process, hist_tag( process, categoryTag, "ABCDNN" ), abcdnnName, mc_weights[ "ABCDNN" ], cuts[ "ABCDNN" ] )
 
   if process not in groups[ "DAT" ] and doSYST:
     nSyst, nSystABCDNN = 0, 0
@@ -273,142 +654,178 @@ def analyze( rTree, nHist, year, process, variable, doSYST, doPDF, doABCDNN, cat
       for shift in [ "UP", "DN" ]:
         histTag = hist_tag( process, categoryTag, syst.upper() + shift )
         if syst.upper() in [ "PREFIRE" ] and year in [ "16APV", "16", "17" ]:
-          rTree[ process ].Draw(
-            "{} >> {}".format( variableName, histTag ),
-            "{} * ({})".format( mc_weights[ syst.upper() ][ shift ], cuts[ "NOMINAL" ] ),
-            "GOFF"
-          )
+          book( bookings, process, histTag, variableName, mc_weights[ "NOMINAL" ], cuts[ "NOMINAL" ], multiplier = mc_weights[ syst.upper() ][ shift ], shifted = mc_shifted.get( syst.upper(), {} ).get( shift ) )
           nSyst += 1
         if syst.upper() in [ "PILEUP", "PILEUPJETID", "MURFCORRD", "MUR", "MUF", "ISR", "FSR" ]:
-          rTree[ process ].Draw( 
-            "{} >> {}".format( variableName, histTag ), 
-            "{} * ({})".format( mc_weights[ syst.upper() ][ shift ], cuts[ "NOMINAL" ] ), 
-            "GOFF" 
-          )
+          book( bookings, process, histTag, variableName, mc_weights[ "NOMINAL" ], cuts[ "NOMINAL" ], multiplier = mc_weights[ syst.upper() ][ shift ], shifted = mc_shifted.get( syst.upper(), {} ).get( shift ) )
           nSyst += 1
         # hot-tagging plots
         elif ( syst.upper() in [ "HOTSTAT", "HOTCSPUR", "HOTCLOSURE" ] and category[ "NHOT" ][0] != "0p" ):
-          rTree[ process ].Draw( 
-            "{} >> {}".format( variableName, histTag ), 
-            "{} * ({})".format( mc_weights[ "NOMINAL" ], cuts[ syst.upper() ][ shift ] ), 
-            "GOFF" 
-          )
+          book( bookings, process, histTag, variableName, mc_weights[ "NOMINAL" ], cuts[ syst.upper() ][ shift ] )
           nSyst += 1
         # t-tagging plots
         elif ( syst.upper() in [ "TAU32", "JMST", "JMRT" ] and category[ "NT" ][0] != "0p" ):
           if "ttagged" in variableName.lower() or "tjet" in variableName.lower():
             shift_indx = 2*np.argwhere( np.array([ "TAU32", "JMST", "JMRT" ]) == syst.upper() )[0,0] + np.argwhere( np.array([ "UP", "DN" ]) == shift )[0,0]
-            rTree[ process ].Draw( 
-              "{}_shifts[{}] >> {}".format( variableName, shift_indx, histTag ), 
-              "{} * ({})".format( mc_weights[ "NOMINAL" ], cuts[ syst.upper() ][ shift ] ), 
-              "GOFF" 
-            )
+            book( bookings, process, histTag, "{}_shifts[{}]".format( variableName, shift_indx ), mc_weights[ "NOMINAL" ], cuts[ syst.upper() ][ shift ] )
             nSyst += 1
           else: 
-            rTree[ process ].Draw( 
-              "{} >> {}".format( variableName, histTag ), 
-              "{} * ({})".format( mc_weights[ "NOMINAL" ], cuts[ syst.upper() ][ shift ] ), 
-              "GOFF" 
-            )
+            book( bookings, process, histTag, variableName, mc_weights[ "NOMINAL" ], cuts[ syst.upper() ][ shift ] )
             nSyst += 1
         # W-tagging plots
         elif ( syst in [ "TAU21", "JMSW", "JMRW", "TAU21PT" ] and category[ "NW" ][0] != "0p" ):
           if "wtagged" in variableName.lower() or "wjet" in variableName.lower():
             shift_indx = 2*np.argwhere( np.array([ "TAU21", "JMSW", "JMRW", "TAU21PT" ]) == syst.upper() )[0,0] + np.argwhere( np.array([ "UP", "DN" ]) == shift )[0,0]
-            rTree[ process ].Draw( 
-              "{}_shifts[{}] >> {}".format( variableName, shift_indx, histTag ), 
-              "{} * ({})".format( mc_weights[ "NOMINAL" ], cuts[ syst.upper() ][ shift ] ), 
-              "GOFF" 
-            )
+            book( bookings, process, histTag, "{}_shifts[{}]".format( variableName, shift_indx ), mc_weights[ "NOMINAL" ], cuts[ syst.upper() ][ shift ] )
             nSyst += 1
           else: 
-            rTree[ process ].Draw( 
-              "{} >> {}".format( variableName, histTag ), 
-              "{} * ({})".format( mc_weights[ "NOMINAL" ], cuts[ syst.upper() ][ shift ] ), 
-              "GOFF" 
-            )
+            book( bookings, process, histTag, variableName, mc_weights[ "NOMINAL" ], cuts[ syst.upper() ][ shift ] )
             nSyst += 1
         # b-tagging plots
         elif ( syst.upper() in [ "LF", "LFSTATS1", "LFSTATS2", "HF", "HFSTATS1", "HFSTATS2", "CFERR1", "CFERR2" ] and category[ "NB" ][0] != "0p" ):
-          rTree[ process ].Draw(
-            "{} >> {}".format( variableName, histTag ), 
-            "{} * ({})".format( mc_weights[ syst.upper() ][ shift ], cuts[ "NOMINAL" ] ), 
-            "GOFF" 
-          )
+          book( bookings, process, histTag, variableName, mc_weights[ "NOMINAL" ], cuts[ "NOMINAL" ], multiplier = mc_weights[ syst.upper() ][ shift ], shifted = mc_shifted.get( syst.upper(), {} ).get( shift ) )
           nSyst += 1
         # process jec and jer
         elif syst.upper() in [ "JER" ]: 
-          rTree[ process + syst.upper() + shift ].Draw( 
-            "{} >> {}".format( variableName, histTag ), 
-            "{} * ({})".format( mc_weights[ "NOMINAL" ], cuts[ "NOMINAL" ] ), 
-            "GOFF" 
-          )
+          book( bookings, process + syst.upper() + shift, histTag, variableName, mc_weights[ "NOMINAL" ], cuts[ "NOMINAL" ] )
           nSyst += 1
         elif syst.upper() in [ "JEC" ]:
           for systJEC in config.systematics[ "REDUCED JEC" ]:
             if not config.systematics[ "REDUCED JEC" ][ systJEC ]: continue
-            rTree[ process + "JEC" + systJEC.upper().replace( "ERA", "20" + args.year ).replace( "APV", "" ).replace( "_", "" ) + shift ].Draw(
-              "{} >> {}".format( variableName, hist_tag( process, categoryTag, "JEC" + systJEC.upper().replace( "ERA", "20" + args.year ).replace( "APV", "" ).replace( "_", "" ) + shift ) ),
-              "{} * ({})".format( mc_weights[ "NOMINAL" ], cuts[ "NOMINAL" ] ),
-              "GOFF" 
-            )
+            systJEC_ = "JEC" + systJEC.upper().replace( "ERA", "20" + args.year ).replace( "APV", "" ).replace( "_", "" )
+            book( bookings, process + systJEC_ + shift, hist_tag( process, categoryTag, systJEC_ + shift ), variableName, mc_weights[ "NOMINAL" ], cuts[ "NOMINAL" ] )
             nSyst += 1
         elif syst.upper() in [ "TOPPT" ]:
-          rTree[ process ].Draw(
-            "{} >> {}".format( variableName, histTag ),
-            "{} * ({})".format( mc_weights[ syst.upper() ][ shift ], cuts[ "NOMINAL" ] )
-          )
+          book( bookings, process, histTag, variableName, mc_weights[ "NOMINAL" ], cuts[ "NOMINAL" ], multiplier = mc_weights[ syst.upper() ][ shift ], shifted = mc_shifted.get( syst.upper(), {} ).get( shift ) )
           nSyst += 1
         else:
           print( "[WARN] {} turned on, but excluded for {} in traditional SF {}...".format( syst.upper() + shift, process, categoryTag ) )
         if syst.upper() in config.params[ "ABCDNN" ][ "SYSTEMATICS" ] and doABCDNN and config.systematics[ "MC" ][ syst ][0]:
           print( "[ABCDNN] Including {} for ABCDnn {} {}".format( syst.upper() + shift, process, categoryTag ) )
           if syst.upper() == "ABCDNNSAMPLE":
-            rTree[ process + "JECABCDNNSAMPLE" + shift ].Draw(
-              "{} >> {}".format( abcdnnName, hist_tag( process, categoryTag, "ABCDNN", syst.upper() + shift ) ),
-              "{} * ({})".format( mc_weights[ "ABCDNN" ], cuts[ "ABCDNN" ] ),
-              "GOFF"
-            )
+            book( bookings, process + "JECABCDNNSAMPLE" + shift, hist_tag( process, categoryTag, "ABCDNN", syst.upper() + shift ), abcdnnName, mc_weights[ "ABCDNN" ], cuts[ "ABCDNN" ] )
             nSystABCDNN += 1
           elif syst.upper() == "ABCDNNCLOSURE":
-            rTree[ process ].Draw(
-              "{} >> {}".format( abcdnnName + "_CLOSURE" + shift, hist_tag( process, categoryTag, "ABCDNN", syst.upper() + shift ) ),
-              "{} * ({})".format( mc_weights[ "ABCDNN {}".format( syst.upper() ) ][ shift ], cuts[ "ABCDNN" ] ),
-              "GOFF"
-            )
+            book( bookings, process, hist_tag( process, categoryTag, "ABCDNN", syst.upper() + shift ), abcdnnName + "_CLOSURE" + shift, mc_weights[ "ABCDNN {}".format( syst.upper() ) ][ shift ], cuts[ "ABCDNN" ] )
             nSystABCDNN += 1
           elif syst.upper() == "ABCDNNMODEL":
-            rTree[ process ].Draw(
-              "{} >> {}".format( abcdnnName + "_MODEL" + shift, hist_tag( process, categoryTag, "ABCDNN", syst.upper() + shift ) ),
-              "{} * ({})".format( mc_weights[ "ABCDNN {}".format( syst.upper() ) ][ shift ], cuts[ "ABCDNN" ] ),
-              "GOFF"
-            )
+            book( bookings, process, hist_tag( process, categoryTag, "ABCDNN", syst.upper() + shift ), abcdnnName + "_MODEL" + shift, mc_weights[ "ABCDNN {}".format( syst.upper() ) ][ shift ], cuts[ "ABCDNN" ] )
             nSystABCDNN += 1
-    if verbose: print( "[DONE] Added {} systematics and {} ABCDnn systematics".format( nSyst, nSystABCDNN ) ) 
+    if verbose: print( "[INFO] Booked {} systematics and {} ABCDnn systematics for {}".format( nSyst, nSystABCDNN, categoryTag ) ) 
 	
   if doPDF:
-    for i in range( config.params[ "GENERAL" ][ "PDF RANGE" ] ):
-      histTag = hist_tag( process, categoryTag, "PDF" + str(i) )
-      rTree[ process ].Draw( 
-        "{} >> {}".format( variableName, histTag ), 
-        "pdfWeights[{}] * {} * ({})".format( i, mc_weights[ "NOMINAL" ], cuts[ "NOMINAL" ] ), 
-        "GOFF" 
-      )
-    if verbose: print( "  + PDF" )
-							
+    pdfWeights = [ "pdfWeights[{}]".format(i) for i in range( config.params[ "GENERAL" ][ "PDF RANGE" ] ) ]
+    book( bookings, process, hist_tag( process, categoryTag, "PDF" ), variableName, mc_weights[ "NOMINAL" ], cuts[ "NOMINAL" ], replicas = pdfWeights )
+
   for key in hists: hists[ key ].SetDirectory(0)
   return hists
 
+def fill_tree( task ):
+  # fill the bookings of one tree from its own TFile, run in a worker with --shiftWorkers
+  samplePath, treeKey, bookings, hists, verbose = task
+  try:
+    for key in hists: hists[ key ].SetDirectory(0)
+    rFile, rTree = read_tree( samplePath )
+    fill_bookings( { treeKey: rTree }, bookings, hists, verbose )
+    rFile.Close()
+  except SystemExit as error: # the pool loses a task whose worker exits, an exception is returned to the parent instead
+    raise RuntimeError( "filling {} exited with {}".format( treeKey, error.code ) )
+  return hists
+
+def process_worker( task ):
+  # process_hists in a worker with --workers, exits are returned to the parent as an exception as in fill_tree
+  try:
+    return process_hists( task )
+  except SystemExit as error:
+    raise RuntimeError( "filling {} exited with {}".format( task[1], error.code ) )
+
+def stop_pool( pool, error ):
+  # a failed worker stops the others and the job, rather than waiting for its result forever
+  pool.terminate()
+  pool.join()
+  quit( "[ERR] {}. Quitting...".format( error ) )
+
+def fill_jobs( rTree, normalization, process, jobs, doSYST, doPDF, doABCDNN, hists, verbose, prefetcher = None ):
+  # book every ( variable, category ) job and fill them together, so each tree is read once for all of them
+  bookings, booked, filled = [], {}, {}
+  for variable, category in jobs:
+    job = ( variable, category_tag( category ) )
+    nBooked = len( bookings )
+    booked[ job ] = analyze( rTree, normalization, args.year, process, variable, doSYST, doPDF, doABCDNN, category, bookings, verbose )
+    for booking in bookings[ nBooked: ]: booking[ "HIST" ] = ( variable, booking[ "HIST" ] ) # histogram names repeat across variables
+    for histTag in booked[ job ]: filled[ ( variable, histTag ) ] = booked[ job ][ histTag ]
+  shiftedTrees = sorted( set( booking[ "TREE" ] for booking in bookings ) - set( [ process ] ) )
+  pool = None
+  if args.shiftWorkers > 1 and len( shiftedTrees ) > 1:
+    # the shifted trees only fill their own nominal-weight histograms, so they are filled in workers while the nominal tree is filled here
+    tasks = []
+    for treeKey in shiftedTrees:
+      treeBookings = [ booking for booking in bookings if booking[ "TREE" ] == treeKey ]
+      tasks.append( ( rTree[ treeKey ].GetCurrentFile().GetName(), treeKey, treeBookings, { booking[ "HIST" ]: filled[ booking[ "HIST" ] ] for booking in treeBookings }, verbose ) )
+    bookings = [ booking for booking in bookings if booking[ "TREE" ] not in shiftedTrees ]
+    pool = multiprocessing.Pool( min( args.shiftWorkers, len( tasks ) ) )
+    results = pool.map_async( fill_tree, tasks )
+  fill_bookings( rTree, bookings, filled, verbose, prefetcher )
+  if pool is not None:
+    try:
+      shifted = results.get()
+    except Exception as error:
+      stop_pool( pool, error )
+    for result in shifted:
+      for key in result: filled[ key ].Add( result[ key ] )
+    pool.close()
+    pool.join()
+  if args.fraction < 1:
+    for key in filled: filled[ key ].Scale( 1. / args.fraction )
+  for job in sorted( booked ):
+    variable, categoryTag = job
+    if verbose:
+      print( "  + NOMINAL {} {}: {} --> {}".format( variable, categoryTag, rTree[ process ].GetEntries(), booked[ job ][ hist_tag( process, categoryTag ) ].Integral() ) )
+      if doABCDNN: print( "  + ABCDNN {} {}: {} --> {}".format( variable, categoryTag, rTree[ process ].GetEntries(), booked[ job ][ hist_tag( process, categoryTag, "ABCDNN" ) ].Integral() ) )
+      if doPDF: print( "  + PDF {} {}: {} replicas --> {}".format( variable, categoryTag, config.params[ "GENERAL" ][ "PDF RANGE" ], booked[ job ][ hist_tag( process, categoryTag, "PDF" ) ].Integral() ) )
+    if job not in hists: hists[ job ] = {}
+    hists[ job ].update( booked[ job ] )
+
+def load_counts( countsPath ):
+  if not os.path.exists( countsPath ): return {}
+  try:
+    with open( countsPath ) as countsFile:
+      return json.load( countsFile )
+  except ValueError:
+    print( "[WARN] Ignoring unreadable NumTrueHist cache {}".format( countsPath ) )
+    return {}
+
+def save_counts( countsPath, updated ):
+  # merged with the entries written by other jobs in the meantime and replaced atomically, so concurrent jobs never read a partial file
+  counts = load_counts( countsPath )
+  counts.update( updated )
+  if not os.path.exists( os.path.dirname( countsPath ) ): os.system( "mkdir -p {}".format( os.path.dirname( countsPath ) ) )
+  tmpPath = "{}.{}.tmp".format( countsPath, os.getpid() )
+  with open( tmpPath, "w" ) as countsFile:
+    json.dump( counts, countsFile, indent = 2, sort_keys = True )
+  os.rename( tmpPath, countsPath )
+
 def numTrueHist( useJES, useABCDNN ):
+  # the NumTrueHist integrals are cached in cacheDir by path, size and modification time of the step1 hadd, only new or changed files are opened
+  countsPath = os.path.join( config.cacheDir[ args.year ], "numTrueHist.json" )
+  counts = load_counts( countsPath )
+  updated, inputs = {}, set()
   def add_process( nHist, group, key, process, shift, postfix ):
     inputDir = config.inputDir[ args.year] 
     if group=="SIG":
         inputDir = config.siginputDir[ args.year ] 
-    rFile = ROOT.TFile.Open( os.path.join( inputDir.replace( "step2", "step1hadds" ), shift + "/", samples.samples[ group ][ process ] + "_{}.root".format( postfix ) ) )
-    #rFile = ROOT.TFile.Open( os.path.join( inputDir, shift + "/", samples.samples[ group ][ process ] + "_{}.root".format( postfix ) ) )
-    print(key) 
-    nHist[ key ] = rFile.Get( "NumTrueHist" ).Integral()
-    rFile.Close()
+    samplePath = os.path.join( inputDir.replace( "step2", "step1hadds" ), shift + "/", samples.samples[ group ][ process ] + "_{}.root".format( postfix ) )
+    #samplePath = os.path.join( inputDir, shift + "/", samples.samples[ group ][ process ] + "_{}.root".format( postfix ) )
+    stat = os.stat( samplePath )
+    inputs.add( samplePath )
+    entry = counts.get( samplePath )
+    if entry is None or entry[ "SIZE" ] != stat.st_size or entry[ "MTIME" ] != int( stat.st_mtime ):
+      print( "  + Reading NumTrueHist of {}".format( key ) )
+      rFile = ROOT.TFile.Open( samplePath )
+      entry = { "SIZE": stat.st_size, "MTIME": int( stat.st_mtime ), "INTEGRAL": rFile.Get( "NumTrueHist" ).Integral() }
+      rFile.Close()
+      counts[ samplePath ] = updated[ samplePath ] = entry
+    nHist[ key ] = entry[ "INTEGRAL" ]
     return nHist
 
   print( "[START] Retrieving the MC hist count" )
@@ -433,78 +850,180 @@ def numTrueHist( useJES, useABCDNN ):
           for shift in [ "up", "down" ]:
             shift_ = "UP" if shift == "up" else "DN"
             add_process( nHist, group, "JECABCDNNSAMPLE" + shift_.upper(), process, "JEC" + shift, "ABCDnn_hadd" )
+  if updated: save_counts( countsPath, updated )
+  print( "[DONE] Read NumTrueHist from {} of {} inputs, the rest from {}".format( len( updated ), len( inputs ), countsPath ) )
   return nHist
 
-def make_hists( groups, group, category, nHist, useABCDNN ): 
-  # only valid group arguments are DAT, SIG, BKG, TEST
+def tree_paths( group, process, isABCDNN ):
+  # input file of the nominal and of every shifted tree of a process, keyed as in rTrees
+  inputDir = config.siginputDir[ args.year ] if group == "SIG" else config.inputDir[ args.year ]
+  paths = {}
+  if isABCDNN:
+    paths[ process ] = os.path.join( inputDir.replace( "step3", "step3_ABCDnn" ), "nominal/", samples.samples[ group ][ process ] + "_ABCDnn_hadd.root" )
+  else:
+    paths[ process ] = os.path.join( inputDir, "nominal/", samples.samples[ group ][ process ] + "_hadd.root" )
+  if group in [ "SIG", "BKG", "TEST" ]:
+    for shift in [ "up", "down" ]:
+      shift_ = "UP" if shift == "up" else "DN"
+      if config.systematics[ "MC" ][ "JEC" ][0]:
+        if isABCDNN and process in samples.groups[ "BKG" ][ "ABCDNN" ] and config.systematics[ "MC" ][ "ABCDNNSAMPLE" ][0]:
+          paths[ process + "JECABCDNNSAMPLE" + shift_ ] = os.path.join( inputDir.replace( "step3", "step3_ABCDnn" ), "JEC" + shift, samples.samples[ group ][ process ] + "_ABCDnn_hadd.root" )
+        for systJEC in config.systematics[ "REDUCED JEC" ]:
+          systJEC_ = systJEC.replace( "Era", "20" + args.year ).replace( "APV", "" )
+          if config.systematics[ "REDUCED JEC" ][ systJEC ]:
+            if systJEC == "Total":
+              paths[ process + "JEC" + systJEC_.upper() + shift_ ] = os.path.join( inputDir, "JEC" + shift, samples.samples[ group ][ process ] + "_hadd.root" )
+            else:
+              paths[ process + "JEC" + systJEC_.upper().replace( "_", "" ) + shift_ ] = os.path.join( inputDir, systJEC_ + shift, samples.samples[ group ][ process ] + "_hadd.root" )
+      if config.systematics[ "MC" ][ "JER" ][0]:
+        paths[ process + "JER" + shift_ ] = os.path.join( inputDir, "JER" + shift, samples.samples[ group ][ process ] + "_hadd.root" )
+  return paths
+
+def record_baskets( rTree, branches ):
+  # stores the basket ranges of the branches of an open tree, so the Prefetcher of later jobs finds them without opening the file
+  path = basket_path( config.cacheDir[ args.year ], rTree.GetCurrentFile().GetName() )
+  baskets = load_baskets( path )
+  missing = [ name for name in sorted( branches ) if name not in baskets ]
+  if not missing: return
+  for name in missing:
+    branch = rTree.GetBranch( name )
+    if not branch:
+      baskets[ name ] = []
+      continue
+    nBaskets = branch.GetWriteBasket() # baskets written to the file, the last one is kept with the tree header
+    basketBytes = branch.GetBasketBytes()
+    if hasattr( basketBytes, "SetSize" ): basketBytes.SetSize( nBaskets )
+    baskets[ name ] = [ ( branch.GetBasketSeek( j ), basketBytes[j] ) for j in range( nBaskets ) ]
+  save_baskets( path, baskets )
+
+def read_files( samplePath, branches ):
+  # ( file, byte ranges ) read when filling the branches from samplePath, called from the Prefetcher thread so ROOT is not used
+  # the .npy files of the branches if it has an up to date column cache, otherwise the recorded baskets of the branches or the whole file
+  path = column_dir( config.cacheDir[ args.year ], samplePath )
+  if config.options[ "HISTS" ][ "COLUMN CACHE" ] and os.path.exists( os.path.join( path, "manifest.json" ) ):
+    return [ ( os.path.join( path, name ), None ) for name in sorted( os.listdir( path ) ) if name.endswith( ".npy" ) and name[ : -len( ".npy" ) ].split( "." )[0] in branches ]
+  baskets = load_baskets( basket_path( config.cacheDir[ args.year ], samplePath ) )
+  if not all( branch in baskets for branch in branches ): return [ ( samplePath, None ) ]
+  return [ ( samplePath, [ basket for branch in branches for basket in baskets[ branch ] ] ) ]
+
+def process_hists( task, prefetcher = None ):
+  # fill every ( variable, category ) job of one process from its nominal and shifted trees, run in a worker with --workers
+  group, process, categories, normalization, useABCDNN = task
   doSys = config.options[ "GENERAL" ][ "SYSTEMATICS" ] if group in [ "SIG", "BKG", "TEST" ] else False
+  hists = {} # ( variable, category ) -> histograms
+  jobs = [ ( variable, category ) for variable in variables for category in categories ]
+  process_time = time.time()
+  # transfer variables in the ABCDnn region are filled from the ABCDnn version of the sample, the rest share the nominal trees
+  abcdnnJobs = [ ( variable, category_tag( category ) ) for variable, category in jobs if useABCDNN and variable in config.params[ "ABCDNN" ][ "TRANSFER VARIABLES" ] and process in samples.groups[ "BKG" ][ "ABCDNN" ] and contains_category( category, config.hist_bins[ "ABCDNN" ] ) ]
+  for isABCDNN in [ False, True ]:
+    processJobs = [ ( variable, category ) for variable, category in jobs if ( ( variable, category_tag( category ) ) in abcdnnJobs ) == isABCDNN ]
+    if len( processJobs ) == 0: continue
+    if isABCDNN: print( "[INFO] Using ABCDnn sample for: {}".format( process ) )
+    rFiles, rTrees = {}, {}
+    paths = tree_paths( group, process, isABCDNN )
+    for treeKey in paths: rFiles[ treeKey ], rTrees[ treeKey ] = read_tree( paths[ treeKey ] )
+    fill_jobs( rTrees, normalization, process, processJobs, doSys, config.options[ "GENERAL" ][ "PDF" ], isABCDNN, hists, True, prefetcher )
+    del rFiles, rTrees
+  print( "[OK] Added hists for {} in {:.2f} minutes".format( process, round( ( time.time() - process_time ) / 60,2 ) ) )
+  return hists
 
+def make_hists( groups, group, categories, normalization, useABCDNN ): 
+  # only valid group arguments are DAT, SIG, BKG, TEST
   inputDir = config.inputDir[ args.year]
   if group=="SIG":
       inputDir = config.siginputDir[ args.year ]
-  hists = {}
-  for process in groups[ group ]:
-    process_time = time.time()
-    rFiles, rTrees = {}, {} 
-    variable = args.variable
-    if useABCDNN and args.variable in config.params[ "ABCDNN" ][ "TRANSFER VARIABLES" ] and process in samples.groups[ "BKG" ][ "ABCDNN" ] and contains_category( category, config.hist_bins[ "ABCDNN" ] ):
-      print( "[INFO] Using ABCDnn sample for: {}".format( process ) )
-      isABCDNN = True
-      rFiles[ process ], rTrees[ process ] = read_tree( os.path.join( inputDir.replace( "step3", "step3_ABCDnn" ), "nominal/", samples.samples[ group ][ process ] + "_ABCDnn_hadd.root" ) ) 
-    else:
-      isABCDNN = False
-      rFiles[ process ], rTrees[ process ] = read_tree( os.path.join( inputDir, "nominal/", samples.samples[ group ][ process ] + "_hadd.root" ) )
-    if group in [ "SIG", "BKG", "TEST" ]:
-      for shift in [ "up", "down" ]:
-        shift_ = "UP" if shift == "up" else "DN"
-        if config.systematics[ "MC" ][ "JEC" ][0]:
-          if isABCDNN and process in samples.groups[ "BKG" ][ "ABCDNN" ] and config.systematics[ "MC" ][ "ABCDNNSAMPLE" ][0]:
-            rFiles[ process + "JECABCDNNSAMPLE" + shift_ ], rTrees[ process + "JECABCDNNSAMPLE" + shift_ ] = read_tree( os.path.join( inputDir.replace( "step3", "step3_ABCDnn" ), "JEC" + shift, samples.samples[ group ][ process ] + "_ABCDnn_hadd.root" ) )
-          for systJEC in config.systematics[ "REDUCED JEC" ]:
-            systJEC_ = systJEC.replace( "Era", "20" + args.year ).replace( "APV", "" )
-            if config.systematics[ "REDUCED JEC" ][ systJEC ]:
-              if systJEC == "Total":
-                rFiles[ process + "JEC" + systJEC_.upper() + shift_ ], rTrees[ process + "JEC" + systJEC_.upper() + shift_ ] = read_tree( os.path.join( inputDir, "JEC" + shift, samples.samples[ group ][ process ] + "_hadd.root" ) )
-              else:
-                rFiles[ process + "JEC" + systJEC_.upper().replace( "_", "" ) + shift_ ], rTrees[ process + "JEC" + systJEC_.upper().replace( "_", "" ) + shift_ ] = read_tree( os.path.join( inputDir, systJEC_ + shift, samples.samples[ group ][ process ] + "_hadd.root" ) )
-        if config.systematics[ "MC" ][ "JER" ][0]:
-          rFiles[ process + "JER" + shift_ ], rTrees[ process + "JER" + shift_ ] = read_tree( os.path.join( inputDir, "JER" + shift, samples.samples[ group ][ process ] + "_hadd.root" ) )
-    hists.update( analyze( rTrees, nHist, args.year, process, variable, doSys, config.options[ "GENERAL" ][ "PDF" ], isABCDNN, category, True ) )
-    print( "[OK] Added hists for {} in {:.2f} minutes".format( process, round( ( time.time() - process_time ) / 60,2 ) ) )
-    del rFiles, rTrees
+  processes = selected_processes( groups[ group ] )
+  if args.processes is not None and len( processes ) == 0: return # the group is filled by other jobs
+  hists = {} # ( variable, category ) -> histograms
+  jobs = [ ( variable, category ) for variable in variables for category in categories ]
+  tasks = [ ( group, process, categories, normalization, useABCDNN ) for process in processes ]
+  # input files of every process, with the ABCDnn version of the sample if it is used
+  taskFiles = []
+  for process in processes:
+    paths = list( tree_paths( group, process, False ).values() )
+    if useABCDNN and process in samples.groups[ "BKG" ][ "ABCDNN" ]: paths += list( tree_paths( group, process, True ).values() )
+    taskFiles.append( paths )
+  # fail before filling anything rather than on the first missing file
+  missing = missing_inputs( [ samplePath for paths in taskFiles for samplePath in paths ] )
+  if missing:
+    for samplePath in missing: print( "[ERR] {} does not exist".format( samplePath ) )
+    quit( "[ERR] {} inputs of {} are missing. Quitting...".format( len( missing ), group ) )
+  if args.workers > 1 and len( tasks ) > 1:
+    # each worker opens its own files, the histograms are pickled back and merged here in the order of the processes
+    pool = multiprocessing.Pool( min( args.workers, len( tasks ) ) )
+    results = pool.imap( process_worker, tasks )
+  else:
+    # the files of the next processes are read ahead in the background while the current one is filled
+    pool, results = None, []
+    prefetcher = Prefetcher( taskFiles, read_files, config.options[ "HISTS" ][ "PREFETCH DEPTH" ], config.options[ "HISTS" ][ "PREFETCH MB" ] * 1024**2 )
+    for i, task in enumerate( tasks ):
+      prefetcher.advance( i )
+      results.append( process_hists( task, prefetcher ) )
+    prefetcher.close()
+  try:
+    for result in results:
+      for job in result:
+        if job not in hists: hists[ job ] = {}
+        hists[ job ].update( result[ job ] )
+  except Exception as error:
+    if pool is None: raise
+    stop_pool( pool, error )
+  if pool is not None:
+    pool.close()
+    pool.join()
 
   if config.options[ "GENERAL" ][ "UE" ] and group in [ "UE" ]:
-    for process in groups[ "UE" ]:
+    for process in selected_processes( groups[ "UE" ] ):
       process_time = time.time()
       rTree = read_tree( os.path.join( inputDir, "nominal/", samples.samples[ "BKG" ][ process ] + "_hadd.root" ) )
-      hists.update( analyze( rTree, nHist, args.year, process, variable, False, config.options[ "GENERAL" ][ "PDF" ], False, category, True ) )
+      fill_jobs( rTree, normalization, process, jobs, False, config.options[ "GENERAL" ][ "PDF" ], False, hists, True )
       print( "[OK] Added hists for {} in {:.2f} minutes".format( process, round( ( time.time() - process_time ) / 60, 2 ) ) )
 
   if config.options[ "GENERAL" ][ "HDAMP" ] and group in [ "HD" ]:
-    for process in groups[ "HD" ]:
+    for process in selected_processes( groups[ "HD" ] ):
       process_time = time.time()
       rTree = read_tree( os.path.join( inputDir, "nominal/", samples.samples[ "BKG" ][ process ] + "_hadd.root" ) )
-      hists.update( analyze( rTree, nHist, args.year, process, variable, False, config.options[ "GENERAL" ][ "PDF" ], False, category, True ) )
+      fill_jobs( rTree, normalization, process, jobs, False, config.options[ "GENERAL" ][ "PDF" ], False, hists, True )
       print( "[OK] Added hists for {} in {:.2f} minutes".format( process, round( ( time.time() - process_time ) / 60, 2 ) ) )
-  categoryDir = "is{}nHOT{}nT{}nW{}nB{}nJ{}".format( category[ "LEPTON" ][0], category[ "NHOT" ][0], category[ "NT" ][0], category[ "NW" ][0], category[ "NB" ][0], category[ "NJ" ][0] )
 
-  if not os.path.exists( "{}/{}".format( args.subDir, categoryDir ) ): os.system( "mkdir -vp {}/{}".format( args.subDir, categoryDir ) )
-  pickle.dump( hists, open( "{}/{}/{}_{}.pkl".format( args.subDir, categoryDir, group, args.variable ), "wb" ) )
+  for variable, category in jobs:
+    categoryDir = category_tag( category )
+    output = dict( hists.get( ( variable, categoryDir ), {} ) )
+    output[ "META" ] = { "FRACTION": args.fraction, "FINE": config.options[ "HISTS" ][ "FINE BINS" ], "ABCDNN UNSCALED": True } # read by templates.py to flag preview templates, rebin master histograms and apply the ABCDnn TF
+    output[ "META" ][ "NORMALIZATION" ] = { process: normalization[ process ][ "FACTOR" ] for process in processes if process in normalization } # read by rescale.py
+    if args.processes is None:
+      outputPath = "{}/{}/{}_{}.pkl".format( args.subDir, categoryDir, group, variable )
+    else: # partial results, summed into <group>_<variable>.pkl by reduce_shards.py
+      output[ "META" ].update( { "GROUP": group, "VARIABLE": variable } )
+      outputPath = "{}/{}/shards/{}_{}_{}{}.pkl".format( args.subDir, categoryDir, group, variable, "-".join( processes ), "_" + shard_tag() if args.shard is not None else "" )
+    if not os.path.exists( os.path.dirname( outputPath ) ): os.system( "mkdir -vp {}".format( os.path.dirname( outputPath ) ) )
+    pickle.dump( output, open( outputPath, "wb" ) )
 
 def main():
   nHist = numTrueHist( config.options[ "GENERAL" ][ "SYSTEMATICS" ], config.options[ "GENERAL" ][ "ABCDNN" ] )
+  normalization = build_table( args.year, samples, nHist, groups[ "BKG" ] + groups[ "SIG" ] + groups[ "TEST" ] )
+  if normalization != load_table( args.year ):
+    save_table( args.year, normalization )
+    print( "[INFO] Updated the normalization table {}".format( table_path( args.year ) ) )
+  if args.normalization: return
   if not config.options[ "GENERAL" ][ "TEST" ]:
     for group in [ "DAT", "BKG", "SIG" ]:
       group_time = time.time()
       print( "[START] Processing hists for {}".format( group ) )
-      for key in category: print( "  - {}: {}".format( key, category[ key ] ) )
-      make_hists( groups, group, category, nHist, config.options[ "GENERAL" ][ "ABCDNN" ] )
+      for category in categories: print( "  - {}".format( category_tag( category ) ) )
+      print( "  - Variables: {}".format( ", ".join( variables ) ) )
+      if args.fraction < 1: print( "  - Preview of {:.1f}% of the events".format( 100. * args.fraction ) )
+      if args.shard is not None: print( "  - Entry range {} of {}".format( args.shard[0], args.shard[1] ) )
+      make_hists( groups, group, categories, normalization, config.options[ "GENERAL" ][ "ABCDNN" ] )
       print( "[DONE] Finished processing hists for {} in {} minutes".format( group, round( ( time.time() - group_time ) / 60, 2 ) ) )
   else:
     test_time = time.time() 
     print( "[START] Processing TEST hists" )
-    for key in category: print( "  - {}: {}".format( key, category[ key ] ) )
-    make_hists( groups, "TEST", category, nHist, config.options[ "GENERAL" ][ "ABCDNN" ] )
+    for category in categories: print( "  - {}".format( category_tag( category ) ) )
+    print( "  - Variables: {}".format( ", ".join( variables ) ) )
+    if args.fraction < 1: print( "  - Preview of {:.1f}% of the events".format( 100. * args.fraction ) )
+    if args.shard is not None: print( "  - Entry range {} of {}".format( args.shard[0], args.shard[1] ) )
+    make_hists( groups, "TEST", categories, normalization, config.options[ "GENERAL" ][ "ABCDNN" ] )
     print( "[DONE] Finished processing hists for TEST in {} minutes".format( round( ( time.time() - test_time ) / 60, 2 ) ) )
 
   print( "[DONE] Finished making hists in {}".format( round( ( time.time() - start_time ) / 60, 2 ) ) )
@@ -4,7 +4,7 @@ import os, sys, time, math, fnmatch
 import numpy as np
 sys.path.append( os.path.dirname( os.getcwd() ) )
 from array import array
-from utils import hist_tag, hist_parse
+from utils import hist_tag, hist_parse, rebin_edges
 import config
 from argparse import ArgumentParser
 
@@ -14,6 +14,7 @@ parser.add_argument( "-t", "--tag", required = True )
 parser.add_argument( "-r", "--region", required = True )
 parser.add_argument( "-v", "--variable", required = True )
 parser.add_argument( "--abcdnn", action = "store_true" )
+parser.add_argument( "--signal", nargs = "+", default = None, help = "only add these signal processes ( added to samples.groups and to the template with templates.py --signal ) to the existing rebinned file, using its bin edges" )
 parser.add_argument( "--verbose", action = "store_true" )
 args = parser.parse_args()
 
@@ -114,6 +115,7 @@ class ModifyTemplate():
     self.doABCDNN = doABCDNN
     self.rebinned = {}
     self.yields = {}
+    self.outpath = self.filepath.replace( ".root", "_rebinned_merge{}_stat{}.root".format( self.params[ "MIN MERGE" ], str( self.params[ "STAT THRESHOLD" ] ).replace( ".", "p" ) ) )
     print( "[INFO] Running ModifyTemplate() with the following options" )
     for option in self.options:
       print( "  + {}: {}".format( option, self.options[ option ] ) )
@@ -121,13 +123,19 @@ class ModifyTemplate():
     for param in self.params:
       print( "  + {}: {}".format( param, self.params[ param ] ) )
     self.load_histograms()
-    self.get_xbins()
+    if args.signal is None: self.get_xbins()
+    else: self.load_xbins()
     self.rebin()
     
   def load_histograms( self ):
     print( "[START] Loading histograms from {}".format( self.filepath ) )
     self.rFile = { "INPUT":  ROOT.TFile( self.filepath ) }
     self.hist_names = [ hist_name.GetName() for hist_name in self.rFile[ "INPUT" ].GetListOfKeys() ]
+    self.preview = None
+    if "PREVIEW" in self.hist_names: # written by templates.py for templates from hists.py --fraction
+      self.hist_names.remove( "PREVIEW" )
+      self.preview = self.rFile[ "INPUT" ].Get( "PREVIEW" ).GetVal()
+      print( "[WARN] {} holds preview templates from {:.1f}% of the events, the rebinning is approximate".format( self.filepath, 100. * self.preview ) )
     self.categories = list( set( hist_parse( hist_name, samples )[ "CATEGORY" ] for hist_name in self.hist_names ) )
     self.channels = list( set( category[3:] for category in self.categories ) )
     
@@ -299,6 +307,21 @@ class ModifyTemplate():
         i, self.xbins[ "MODIFY" ][ channel ]
       ) )
         
+  def load_xbins( self ):
+    # bin edges of the rebinned file already written, so added signal processes are binned as the rest of the templates
+    print( "[START] Reading the modified histogram binning from {}".format( self.outpath ) )
+    if not os.path.exists( self.outpath ): quit( "[ERR] {} does not exist, run modify_binning.py without --signal first. Quitting...".format( self.outpath ) )
+    rFile = ROOT.TFile( self.outpath )
+    self.xbins = { "MODIFY": {} }
+    for key in rFile.GetListOfKeys():
+      parse = hist_parse( key.GetName(), samples )
+      if parse[ "GROUP" ] != "DAT" or parse[ "CHANNEL" ] in self.xbins[ "MODIFY" ]: continue
+      axis = rFile.Get( key.GetName() ).GetXaxis()
+      self.xbins[ "MODIFY" ][ parse[ "CHANNEL" ] ] = array( "d", [ axis.GetBinLowEdge(i) for i in range( 1, axis.GetNbins() + 2 ) ] )
+    rFile.Close()
+    for channel in sorted( self.xbins[ "MODIFY" ] ):
+      print( "   + {} ({} bins): {}".format( channel, len( self.xbins[ "MODIFY" ][ channel ] ) - 1, list( self.xbins[ "MODIFY" ][ channel ] ) ) )
+
   def rebin( self ): # done
   # merge the histogram bins using an uncertainty threshold requiring bin error / yield <= threshold
   # the merging requirements are determined in self.get_xbins()
@@ -312,11 +335,7 @@ class ModifyTemplate():
         for channel in self.xbins[ "MODIFY" ]:
           if channel in hist_name:
             xbins_channel = self.xbins[ "MODIFY" ][ channel ]
-        self.rebinned[ hist_key ][ hist_name ] = self.histograms[ hist_key ][ hist_name ].Rebin(
-          len( xbins_channel ) - 1,
-          hist_name,
-          xbins_channel
-        )
+        self.rebinned[ hist_key ][ hist_name ] = rebin_edges( self.histograms[ hist_key ][ hist_name ], xbins_channel, hist_name )
         self.rebinned[ hist_key ][ hist_name ].SetDirectory(0)
         overflow( self.rebinned[ hist_key ][ hist_name ] )
         underflow( self.rebinned[ hist_key ][ hist_name ] )
@@ -757,9 +776,11 @@ class ModifyTemplate():
     print( "[DONE] Added {} smoothed systematic histograms".format( count ) )
       
   def write_combine( self ):
-    self.outpath = self.filepath.replace( ".root", "_rebinned_merge{}_stat{}.root".format( self.params[ "MIN MERGE" ], str( self.params[ "STAT THRESHOLD" ] ).replace( ".", "p" ) ) )
     print( "[START] Storing modified histograms in {}".format( self.outpath ) )
-    self.rFile[ "OUTPUT" ] = ROOT.TFile( self.outpath, "RECREATE" )
+    # with --signal only the added signal histograms are written over the existing file
+    self.rFile[ "OUTPUT" ] = ROOT.TFile( self.outpath, "RECREATE" if args.signal is None else "UPDATE" )
+    option = 0 if args.signal is None else ROOT.TObject.kOverwrite
+    if self.preview is not None and args.signal is None: ROOT.TParameter( "double" )( "PREVIEW", self.preview ).Write()
     count = 0
     for hist_key in self.rebinned:
       if "TOTAL" in hist_key: continue
@@ -767,17 +788,18 @@ class ModifyTemplate():
       print( ">> Loading {}".format( hist_key ) )
       for hist_name in hist_names:
         if "PDF" in hist_name and not ( hist_name.endswith( "UP" ) or hist_name.endswith( "DN" ) ): continue
+        parse = hist_parse( hist_name, samples )
+        if args.signal is not None and ( parse[ "GROUP" ] != "SIG" or parse[ "PROCESS" ] not in args.signal ): continue
         negative_bin_correction( self.rebinned[ hist_key ][ hist_name ] )
-        self.rebinned[ hist_key ][ hist_name ].Write() # for plotting
+        self.rebinned[ hist_key ][ hist_name ].Write( "", option ) # for plotting
         count += 1
-        parse = hist_parse( hist_name, samples )
         if parse[ "SYST" ] == "ABCDNN" and not hist_name.startswith( "ABCDNN" ): continue
         shift = "Down" if hist_name.endswith( "DN" ) else "Up"
         combine_tag = "NOMINAL" if not parse[ "IS SYST" ] else parse[ "SYST" ] + shift
         combine_name = hist_tag( parse[ "COMBINE" ], parse[ "CATEGORY" ], combine_tag )
         self.rebinned[ hist_key ][ combine_name ] = self.rebinned[ hist_key ][ hist_name ].Clone( combine_name )
         negative_bin_correction( self.rebinned[ hist_key ][ combine_name ] )
-        self.rebinned[ hist_key ][ combine_name ].Write()
+        self.rebinned[ hist_key ][ combine_name ].Write( "", option )
         count += 1
     print( "[DONE] {} histograms written to Combine template.".format( count ) )
     self.rFile[ "OUTPUT" ].Close()
@@ -164,7 +164,8 @@ def load_histograms( groups, templateDir, rebinned, scale_signal_xsec, scale_sig
   if smooth:
     print( "[INFO] Including the following smoothed systematic uncertainties: " )
     for syst_ in smooth_syst: print( "  + {}".format( syst_ ) )
-  hist_names = [ key.GetName() for key in rFile.GetListOfKeys() ]
+  if rFile.Get( "PREVIEW" ): print( "[WARN] Plotting preview templates from {:.1f}% of the events".format( 100. * rFile.Get( "PREVIEW" ).GetVal() ) )
+  hist_names = [ key.GetName() for key in rFile.GetListOfKeys() if key.GetName() != "PREVIEW" ]
   categories = []
   for hist_name in sorted( hist_names ):
     if "isL" in hist_name: continue # skip the decorrelated histograms and lepton categories
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+
+import os, sys, glob, time, pickle
+from argparse import ArgumentParser
+
+sys.path.append( os.path.dirname( "../" ) )
+
+# sums the partial histograms written by hists.py --processes/--shard into the <group>_<variable>.pkl of every category
+# the merged shards are recorded in the output, so running the reduction again does not count them twice
+
+parser = ArgumentParser()
+parser.add_argument( "-sd", "--subDir", required = True, help = "output directory of hists.py, i.e. templates_SR_UL17_test" )
+parser.add_argument( "--clean", action = "store_true", help = "delete the shards once they are merged" )
+args = parser.parse_args()
+
+import ROOT
+
+ROOT.gROOT.SetBatch(1)
+
+def reduce_category( categoryDir ):
+  outputs = {} # ( group, variable ) -> merged histograms
+  shardPaths = sorted( glob.glob( os.path.join( categoryDir, "shards", "*.pkl" ) ) )
+  for shardPath in shardPaths:
+    shard = pickle.load( open( shardPath, "rb" ) )
+    meta = shard.pop( "META" )
+    key = ( meta[ "GROUP" ], meta[ "VARIABLE" ] )
+    if key not in outputs:
+      outputPath = os.path.join( categoryDir, "{}_{}.pkl".format( *key ) )
+      outputs[ key ] = pickle.load( open( outputPath, "rb" ) ) if os.path.exists( outputPath ) else {}
+      outputs[ key ].setdefault( "META", { "FRACTION": meta[ "FRACTION" ], "FINE": meta.get( "FINE", 0 ), "ABCDNN UNSCALED": meta.get( "ABCDNN UNSCALED", False ) } ).setdefault( "SHARDS", [] )
+    hists = outputs[ key ]
+    if os.path.basename( shardPath ) in hists[ "META" ][ "SHARDS" ]: continue
+    if meta[ "FRACTION" ] != hists[ "META" ][ "FRACTION" ]:
+      print( "[WARN] {} was filled from {:.1f}% of the events, the rest of {}_{} from {:.1f}%".format( shardPath, 100. * meta[ "FRACTION" ], key[0], key[1], 100. * hists[ "META" ][ "FRACTION" ] ) )
+      hists[ "META" ][ "FRACTION" ] = min( meta[ "FRACTION" ], hists[ "META" ][ "FRACTION" ] )
+    for histTag in shard:
+      if histTag in hists: hists[ histTag ].Add( shard[ histTag ] )
+      else: hists[ histTag ] = shard[ histTag ]
+    hists[ "META" ][ "SHARDS" ].append( os.path.basename( shardPath ) )
+    hists[ "META" ].setdefault( "NORMALIZATION", {} ).update( meta.get( "NORMALIZATION", {} ) ) # read by rescale.py
+
+  for key in outputs:
+    outputPath = os.path.join( categoryDir, "{}_{}.pkl".format( *key ) )
+    pickle.dump( outputs[ key ], open( outputPath, "wb" ) )
+    print( "  + {}: {} histograms from {} shards".format( outputPath, len( outputs[ key ] ) - 1, len( outputs[ key ][ "META" ][ "SHARDS" ] ) ) )
+  if args.clean:
+    for shardPath in shardPaths: os.remove( shardPath )
+  return len( shardPaths )
+
+def main():
+  start_time = time.time()
+  print( "[START] Reducing the shards in {}".format( args.subDir ) )
+  nShards = 0
+  for categoryDir in sorted( glob.glob( os.path.join( args.subDir, "*" ) ) ):
+    if not os.path.isdir( os.path.join( categoryDir, "shards" ) ): continue
+    print( ">> Reducing {}".format( os.path.basename( categoryDir ) ) )
+    nShards += reduce_category( categoryDir )
+  print( "[DONE] Reduced {} shards in {:.2f} minutes".format( nShards, ( time.time() - start_time ) / 60. ) )
+
+main()
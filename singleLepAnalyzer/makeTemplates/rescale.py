@@ -0,0 +1,68 @@
+#!/usr/bin/python
+
+import os, sys, glob, time, pickle
+from argparse import ArgumentParser
+
+sys.path.append( os.path.dirname( "../" ) )
+
+from normalization import load_table, save_table, scale_factor, table_path
+from xsec import xsec
+import config
+
+# applies changed cross sections or luminosities in xsec.py and config.py to the histograms of hists.py without filling them again
+# each histogram is scaled by the new over the old lumi * xsec / NumTrueHist recorded in its output, the ABCDnn histograms are not normalized by it
+
+parser = ArgumentParser()
+parser.add_argument( "-y", "--year", default = "17" )
+parser.add_argument( "-sd", "--subDir", required = True, help = "output directory of hists.py, i.e. templates_SR_UL17_test" )
+args = parser.parse_args()
+
+import ROOT
+
+ROOT.gROOT.SetBatch(1)
+
+def update_table():
+  table = load_table( args.year )
+  if not table: quit( "[ERR] {} does not exist, run hists.py --normalization first. Quitting...".format( table_path( args.year ) ) )
+  for process in sorted( table ):
+    if process not in xsec:
+      print( "[WARN] {} is no longer in xsec.py, keeping its factor".format( process ) )
+      continue
+    factor = scale_factor( args.year, process, table[ process ][ "NTRUE" ] )
+    if factor != table[ process ][ "FACTOR" ]:
+      print( "  + {}: {:.6g} --> {:.6g}".format( process, table[ process ][ "FACTOR" ], factor ) )
+    table[ process ].update( { "LUMI": config.lumi[ args.year ], "XSEC": xsec[ process ], "FACTOR": factor } )
+  save_table( args.year, table )
+  return table
+
+def rescale( histPath, table ):
+  hists = pickle.load( open( histPath, "rb" ) )
+  factors = hists.get( "META", {} ).get( "NORMALIZATION" )
+  if factors is None:
+    print( "[WARN] {} does not record its normalization, skipping".format( histPath ) )
+    return 0
+  nScaled = 0
+  for histTag in hists:
+    if histTag == "META" or "ABCDNN" in histTag.split( "_" ): continue
+    process = histTag.split( "_" )[0]
+    if process not in factors or process not in table or factors[ process ] == table[ process ][ "FACTOR" ]: continue
+    hists[ histTag ].Scale( table[ process ][ "FACTOR" ] / factors[ process ] )
+    nScaled += 1
+  if nScaled == 0: return 0
+  for process in factors:
+    if process in table: factors[ process ] = table[ process ][ "FACTOR" ]
+  pickle.dump( hists, open( histPath, "wb" ) )
+  print( "  + {}: rescaled {} histograms".format( histPath, nScaled ) )
+  return nScaled
+
+def main():
+  start_time = time.time()
+  print( "[START] Updating the normalization table {}".format( table_path( args.year ) ) )
+  table = update_table()
+  print( "[START] Rescaling the histograms in {}".format( args.subDir ) )
+  nScaled = 0
+  for histPath in sorted( glob.glob( os.path.join( args.subDir, "*", "*.pkl" ) ) + glob.glob( os.path.join( args.subDir, "*", "shards", "*.pkl" ) ) ):
+    nScaled += rescale( histPath, table )
+  print( "[DONE] Rescaled {} histograms in {:.2f} minutes".format( nScaled, ( time.time() - start_time ) / 60. ) )
+
+main()
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+
+import os, sys, time
+import numpy as np
+from argparse import ArgumentParser
+
+sys.path.append( os.path.dirname( "../" ) )
+
+from utils import sample_paths
+from selection import selection_path, save_entries, load_entries
+import config
+
+# stores the entries of every ljmet tree passing config.base_cut in config.cacheDir, hists.py starts from them when present
+# the entry list is keyed by config.base_cut and the size and modification time of the input, so either changing makes a new one
+
+parser = ArgumentParser()
+parser.add_argument( "-y", "--year", default = "17" )
+parser.add_argument( "-g", "--groups", nargs = "+", default = [ "DAT", "BKG", "SIG" ] )
+parser.add_argument( "--nominal", action = "store_true", help = "only skim the nominal trees, not the JEC and JER shifted ones" )
+parser.add_argument( "--force", action = "store_true", help = "skim again even if the entry list is up to date" )
+args = parser.parse_args()
+
+if args.year == "16APV":
+  import samplesUL16APV as samples
+elif args.year == "16":
+  import samplesUL16 as samples
+elif args.year == "17":
+  import samplesUL17 as samples
+elif args.year == "18":
+  import samplesUL18 as samples
+else:
+  quit( "[ERR] Invalid -y (--year) option used. Quitting..." )
+
+import ROOT
+
+ROOT.gROOT.SetBatch(1)
+
+def skim( samplePath ):
+  rFile = ROOT.TFile.Open( samplePath, "READ" )
+  rTree = rFile.Get( "ljmet" )
+  nEntries = rTree.GetEntries()
+  skimPath = selection_path( config.cacheDir[ args.year ], samplePath, [ config.base_cut ], "skim" )
+  if not args.force and load_entries( skimPath, nEntries ) is not None:
+    print( "  + {} is up to date".format( skimPath ) )
+    rFile.Close()
+    return
+  # Entry$ of the events passing the cut, evaluated by TTreeFormula as in TTree::Draw
+  rTree.SetEstimate( nEntries + 1 )
+  nSelected = rTree.Draw( "Entry$", config.base_cut, "goff" )
+  entries = np.zeros( 0, dtype = np.int64 )
+  if nSelected > 0:
+    v1 = rTree.GetV1()
+    if hasattr( v1, "SetSize" ): v1.SetSize( nSelected ) # PyROOT buffers before ROOT 6.22
+    else: v1.reshape( ( nSelected, ) )
+    entries = np.sort( np.frombuffer( v1, dtype = np.float64, count = nSelected ).astype( np.int64 ) )
+  save_entries( skimPath, nEntries, entries )
+  print( "  + {}/{} entries pass the base cut, saved to {}".format( len( entries ), nEntries, skimPath ) )
+  rFile.Close()
+
+def main():
+  for group in args.groups:
+    group_time = time.time()
+    print( "[START] Skimming {} with the base cut: {}".format( group, config.base_cut ) )
+    for samplePath in sample_paths( samples, args.year, group, args.nominal ):
+      if not os.path.exists( samplePath ):
+        print( "[WARN] {} does not exist, skipping".format( samplePath ) )
+        continue
+      print( ">> Skimming {}".format( samplePath ) )
+      skim( samplePath )
+    print( "[DONE] Finished skimming {} in {:.2f} minutes".format( group, ( time.time() - group_time ) / 60. ) )
+
+main()
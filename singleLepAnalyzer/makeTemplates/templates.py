@@ -6,7 +6,7 @@ sys.path.append( "../../" )
 from argparse import ArgumentParser
 import numpy as np
 from array import array
-from utils import hist_parse, hist_tag
+from utils import hist_parse, hist_tag, pdf_replicas, rebin_edges
 import config
 
 parser = ArgumentParser()
@@ -15,6 +15,8 @@ parser.add_argument( "-t", "--tag", required = True )
 parser.add_argument( "-v", "--variables", nargs = "+", required = True )
 parser.add_argument( "-r", "--region", required = True )
 parser.add_argument( "--verbose", action = "store_true" )
+parser.add_argument( "--signal", nargs = "+", default = None, help = "only add these signal processes to the existing template_combine file, i.e. a new mass point filled with hists.py --processes and merged by reduce_shards.py" )
+parser.add_argument( "--fine", action = "store_true", help = "keep the bins of master histograms filled with FINE BINS, for modify_binning.py to merge" )
 args = parser.parse_args()
 
 # parse options
@@ -33,7 +35,7 @@ elif args.year == "18":
 else:
   quit( "[ERR] Invalid -y (--year) argument used. Quitting" )
 
-from ROOT import gROOT, TFile, TH1F, Double
+from ROOT import gROOT, TFile, TH1F, TParameter, TObject, Double
 
 gROOT.SetBatch(1)
 
@@ -45,6 +47,10 @@ def load_histograms( variable, templateDir, categories ):
   print( "[START] Loading histograms from {} for {}".format( templateDir, variable ) )
   sTime = time.time()
   hists =  {}
+  fraction = 1. # smallest hists.py --fraction of the loaded pickles
+  edges = config.plot_params[ "VARIABLES" ][ variable ][1]
+  abcdnnTF = config.params[ "ABCDNN" ][ "TF" ][ args.year ] * config.params[ "ABCDNN" ][ "TF SCALE" ]
+  nFine, nTF = 0, 0
   
   for category in categories:
     if args.verbose: print( "  >> Loading category: {}".format( category ) )
@@ -52,14 +58,39 @@ def load_histograms( variable, templateDir, categories ):
     hist_keys = [ filename.split( "_" )[0] for filename in os.listdir( categoryDir ) if filename.endswith( ".pkl" ) ]
     for hist_key in hist_keys:
       if hist_key == "TEST" and not config.options[ "GENERAL" ][ "TEST" ]: continue
+      if args.signal is not None and hist_key != "SIG": continue
       if hist_key not in hists: hists[ hist_key ] = {}
-      hists[ hist_key ].update( pickle.load( open( os.path.join( categoryDir, "{}_{}.pkl".format( hist_key, variable ) ), "rb" ) ) ) 
+      pickled = pickle.load( open( os.path.join( categoryDir, "{}_{}.pkl".format( hist_key, variable ) ), "rb" ) )
+      meta = pickled.pop( "META", {} )
+      if args.signal is not None: pickled = { hist_name: pickled[ hist_name ] for hist_name in pickled if hist_name.split( "_" )[0] in args.signal }
+      fraction = min( fraction, meta.get( "FRACTION", 1. ) )
+      if meta.get( "ABCDNN UNSCALED", False ):
+        # hists.py fills the ABCDnn histograms without the extended ABCD transfer factor, older pickles have it filled in
+        for hist_name in pickled:
+          if "ABCDNN" not in hist_name.split( "_" ): continue
+          pickled[ hist_name ].Scale( abcdnnTF )
+          nTF += 1
+      if meta.get( "FINE", 0 ) > 0 and not args.fine:
+        # master histograms from hists.py with FINE BINS are summed into the current plot_params binning
+        for hist_name in [ hist_name for hist_name in pickled if pickled[ hist_name ].InheritsFrom( "TH2" ) ]:
+          for replica in pdf_replicas( pickled.pop( hist_name ) ):
+            pickled[ replica.GetName() ] = replica
+        for hist_name in pickled: rebin_edges( pickled[ hist_name ], edges )
+        nFine += len( pickled )
+      hists[ hist_key ].update( pickled ) 
+  for hist_key in hists:
+    for hist_name in [ hist_name for hist_name in hists[ hist_key ] if hists[ hist_key ][ hist_name ].InheritsFrom( "TH2" ) ]:
+      for replica in pdf_replicas( hists[ hist_key ].pop( hist_name ) ):
+        hists[ hist_key ][ replica.GetName() ] = replica
   count = 0
   for hist_key in hists:
     count += len( hists[ hist_key ].keys() )
 
+  if nTF > 0: print( "[INFO] Scaled {} ABCDnn histograms by the transfer factor {} * {}".format( nTF, config.params[ "ABCDNN" ][ "TF" ][ args.year ], config.params[ "ABCDNN" ][ "TF SCALE" ] ) )
+  if nFine > 0: print( "[INFO] Summed {} fine-binned histograms into the {} bins of config.plot_params".format( nFine, len( edges ) - 1 ) )
   print( "[DONE] Finished loading {} histograms in {:.2f} minutes".format( count, ( time.time() - sTime ) / 60 ) )
-  return hists
+  if fraction < 1: print( "[WARN] Histograms were filled from a {:.1f}% preview of the events (hists.py --fraction), the templates are approximate".format( 100. * fraction ) )
+  return hists, fraction
   
 def clean_histograms( hists, hist_key, scale, rebin ):
   def scale_luminosity( hists_, hist_key, scale ):
@@ -249,11 +280,50 @@ def combine_histograms( hists, variable, categories, groups, doABCDNN ):
     print( "   + {}: {}".format( key, count[ key ] ) )
   return hists
 
-def write_combine( hists, variable, categories, groups, templateDir, doABCDNN ):
+def write_signal( hists, process, category, option = 0 ):
+  hists[ "CMB" ][ hist_tag( process, category ) ].Write( "", option )
+  print( "  + SIG > {}: {}".format( hist_tag( process, category ), hists[ "CMB" ][ hist_tag( process, category ) ].Integral() ) )
+  if config.options[ "GENERAL" ][ "SYSTEMATICS" ]:
+    if args.verbose: print( "  + SIG SYST > {}".format( hist_tag( process, category ) ) )
+    for syst in config.systematics[ "MC" ].keys():
+      if args.year == "18" and syst.upper() == "PREFIRE": continue
+      if not config.systematics[ "MC" ][ syst ][0] or "ABCD" in syst: continue
+      if syst == "HD" and not config.options[ "GENERAL" ][ "HDAMP" ]: continue
+      if syst == "UE" and not config.options[ "GENERAL" ][ "UE" ]: continue
+      if args.verbose: print( "[INFO] Including {} to Combine template".format( syst ) )
+      for shift in [ "UP", "DN" ]:
+        if syst == "JEC":
+          for systJEC in config.systematics[ "REDUCED JEC" ]:
+            if not config.systematics[ "REDUCED JEC" ][ systJEC ]: continue
+            systJEC_ = "JEC" + systJEC.replace( "Era", "20" + args.year ).replace( "APV", "" ).replace( "_", "" )
+            hists[ "CMB" ][ hist_tag( process, category, systJEC_.upper() + shift ) ].Write( "", option )
+        else:
+          hists[ "CMB" ][ hist_tag( process, category, syst.upper() + shift ) ].Write( "", option )
+  if config.options[ "GENERAL" ][ "PDF" ]:
+    if args.verbose: print( "  + SIG PDF > {}".format( hist_tag( process, category ) ) )
+    for i in range( config.params[ "GENERAL" ][ "PDF RANGE" ] ):
+      hists[ "CMB" ][ hist_tag( process, category, "PDF" + str(i) ) ].Write( "", option )
+
+def append_combine( hists, variable, categories, templateDir ):
+  # adds the --signal processes to the template_combine file of the full templates.py run, its other histograms are left as they are
+  print( "[START] Adding {} to the Combine templates".format( ", ".join( args.signal ) ) )
+  sTime = time.time()
+  combine_name = "{}/template_combine_{}_UL{}.root".format( templateDir, variable, args.year )
+  if not os.path.exists( combine_name ): quit( "[ERR] {} does not exist, run templates.py without --signal first. Quitting...".format( combine_name ) )
+  combine_file = TFile( combine_name, "UPDATE" )
+  for category in categories:
+    print( ">> Writing category: {}".format( category ) )
+    for process in args.signal:
+      write_signal( hists, process, category, TObject.kOverwrite )
+  combine_file.Close()
+  print( "[DONE] Finished adding to the Combine templates in {:.2f} minutes".format( ( time.time() - sTime ) / 60. ) )
+
+def write_combine( hists, variable, categories, groups, templateDir, doABCDNN, fraction ):
   print( "[START] Writing Combine templates" )
   sTime = time.time()
   combine_name = "{}/template_combine_{}_UL{}.root".format( templateDir, variable, args.year )
   combine_file = TFile( combine_name, "RECREATE" )
+  if fraction < 1: TParameter( "double" )( "PREVIEW", fraction ).Write() # flags preview templates for modify_binning.py and create_datacard.py
 
   for category in categories:
     print( ">> Writing category: {}".format( category ) )
@@ -261,28 +331,7 @@ def write_combine( hists, variable, categories, groups, templateDir, doABCDNN ):
     print( "  + DAT > {}: {}".format( hist_tag( "data_obs", category ), hists[ "CMB" ][ hist_tag( "data_obs", category ) ].Integral() ) )
 
     for process in groups[ "SIG" ][ "PROCESS" ]:
-      hists[ "CMB" ][ hist_tag( process, category ) ].Write()
-      print( "  + SIG > {}: {}".format( hist_tag( process, category ), hists[ "CMB" ][ hist_tag( process, category ) ].Integral() ) )
-      if config.options[ "GENERAL" ][ "SYSTEMATICS" ]:
-        if args.verbose: print( "  + SIG SYST > {}".format( hist_tag( process, category ) ) )
-        for syst in config.systematics[ "MC" ].keys():
-          if args.year == "18" and syst.upper() == "PREFIRE": continue
-          if not config.systematics[ "MC" ][ syst ][0] or "ABCD" in syst: continue
-          if syst == "HD" and not config.options[ "GENERAL" ][ "HDAMP" ]: continue
-          if syst == "UE" and not config.options[ "GENERAL" ][ "UE" ]: continue
-          if args.verbose: print( "[INFO] Including {} to Combine template".format( syst ) )
-          for shift in [ "UP", "DN" ]:
-            if syst == "JEC":
-              for systJEC in config.systematics[ "REDUCED JEC" ]:
-                if not config.systematics[ "REDUCED JEC" ][ systJEC ]: continue
-                systJEC_ = "JEC" + systJEC.replace( "Era", "20" + args.year ).replace( "APV", "" ).replace( "_", "" )
-                hists[ "CMB" ][ hist_tag( process, category, systJEC_.upper() + shift ) ].Write()
-            else:
-              hists[ "CMB" ][ hist_tag( process, category, syst.upper() + shift ) ].Write()
-      if config.options[ "GENERAL" ][ "PDF" ]:
-        if args.verbose: print( "  + SIG PDF > {}".format( hist_tag( process, category ) ) )
-        for i in range( config.params[ "GENERAL" ][ "PDF RANGE" ] ):
-          hists[ "CMB" ][ hist_tag( process, category, "PDF" + str(i) ) ].Write()
+      write_signal( hists, process, category )
 
     yield_total = sum( [ hists[ "CMB" ][ hist_tag( group, category ) ].Integral() for group in groups[ "BKG" ][ "SUPERGROUP" ] if hist_tag( group, category ) in hists[ "CMB" ].keys() ] )
     min_bkg_yield = 0 if args.region in [ "BASELINE", "ABCDNN" ] else config.params[ "HISTS" ][ "MIN BKG YIELD" ]
@@ -600,12 +649,16 @@ def main():
   groups = samples.groups 
 
   for variable in args.variables:
-    hists = load_histograms( variable, templateDir, categories )
+    hists, fraction = load_histograms( variable, templateDir, categories )
     for hist_key in hists:
       if len( hists[ hist_key ].keys() ) <= 0: continue
       hists = clean_histograms( hists, hist_key, config.params[ "HISTS" ][ "LUMISCALE" ], config.params[ "HISTS" ][ "REBIN" ] )
     hists = combine_histograms( hists, variable, categories, groups, config.options[ "GENERAL" ][ "ABCDNN" ] )
-    write_combine( hists, variable, categories, groups, templateDir, config.options[ "GENERAL" ][ "ABCDNN" ] )
+    if args.signal is not None:
+      append_combine( hists, variable, categories, templateDir )
+      del hists
+      continue
+    write_combine( hists, variable, categories, groups, templateDir, config.options[ "GENERAL" ][ "ABCDNN" ], fraction )
     tables = make_tables( hists, categories, groups, variable, templateDir, config.lumiStr[ args.year ], config.options[ "GENERAL" ][ "ABCDNN" ] )
     print_tables( tables, categories, groups, variable, templateDir )
     del hists
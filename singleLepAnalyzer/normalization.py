@@ -0,0 +1,54 @@
+#!/usr/bin/python
+
+import os, json
+import config
+from xsec import xsec
+
+# per-process MC normalization lumi * xsec / NumTrueHist, kept per year in cacheDir/normalization.json
+# hists.py looks the factors up and records them in its output, makeTemplates/rescale.py applies a changed xsec or lumi to existing histograms
+
+def table_path( year ):
+  return os.path.join( config.cacheDir[ year ], "normalization.json" )
+
+def training_scale( process ):
+  # MC samples used in DNN training were partitioned into 60/20/20, so isTraining==1 || isTraining==3 is scaled by 1.25
+  return 1.25 if process.startswith( "TTTo" ) or process.startswith( "TTTW" ) or process.startswith( "TTTJ" ) else 1.
+
+def true_count( process, samples, nHist ):
+  nTrueHist = nHist[ process ]
+  for splitPrefix in samples.split:
+    if splitPrefix in process:
+      for splitProcess in samples.split[ splitPrefix ]:
+        if process != splitProcess: nTrueHist += nHist[ splitProcess ]
+      print( "[INFO] {} was hadded into more than one file, consolidating numTrueHist across split files: {} --> {}".format( process, nHist[ process ], nTrueHist ) )
+  return nTrueHist
+
+def scale_factor( year, process, nTrueHist ):
+  return config.lumi[ year ] * xsec[ process ] / nTrueHist
+
+def build_table( year, samples, nHist, processes ):
+  table = {}
+  for process in processes:
+    if process not in xsec or process not in nHist: continue
+    nTrueHist = true_count( process, samples, nHist )
+    table[ process ] = {
+      "LUMI": config.lumi[ year ],
+      "XSEC": xsec[ process ],
+      "NTRUE": nTrueHist,
+      "FACTOR": scale_factor( year, process, nTrueHist ),
+      "TRAINING": training_scale( process ) # only applied to the DNN variables
+    }
+  return table
+
+def load_table( year ):
+  if not os.path.exists( table_path( year ) ): return {}
+  with open( table_path( year ) ) as tableFile:
+    return json.load( tableFile )
+
+def save_table( year, table ):
+  path = table_path( year )
+  if not os.path.exists( os.path.dirname( path ) ): os.system( "mkdir -p {}".format( os.path.dirname( path ) ) )
+  tmpPath = "{}.{}.tmp".format( path, os.getpid() )
+  with open( tmpPath, "w" ) as tableFile:
+    json.dump( table, tableFile, indent = 2, sort_keys = True )
+  os.rename( tmpPath, path )
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+
+import os, threading
+import numpy as np
+from selection import selection_path, write_npz
+try:
+  import queue
+except ImportError:
+  import Queue as queue
+
+# reads the input files of the next processes in a background thread, so opening them and reading their baskets hits the filesystem cache
+# the tail of every ROOT file ( keys, StreamerInfo and tree header ) is read as soon as a process starts, then only the byte ranges of the
+# branches enabled by the current process, which locate( path, branches ) returns as [ ( file, [ ( offset, length ) ] or None for the whole file ) ]
+# locate runs in the background thread and must not call ROOT, the basket ranges of a file are recorded when it is filled and kept in cacheDir
+
+def basket_path( cacheDir, samplePath ):
+  return selection_path( cacheDir, samplePath, [], "baskets" )
+
+def load_baskets( path ):
+  # branch -> [ ( seek, bytes ) ] of its baskets, an empty list for a branch the tree does not have, {} without a valid cache
+  if not os.path.exists( path ): return {}
+  cache = np.load( path )
+  try:
+    baskets = { str( branch ): list( zip( cache[ "SEEK{}".format(i) ].tolist(), cache[ "BYTES{}".format(i) ].tolist() ) ) for i, branch in enumerate( cache[ "BRANCHES" ] ) }
+  except ( IOError, KeyError, ValueError ):
+    print( "[WARN] Ignoring unreadable basket cache {}".format( path ) )
+    return {}
+  finally:
+    cache.close()
+  return baskets
+
+def save_baskets( path, baskets ):
+  branches = sorted( baskets )
+  arrays = { "BRANCHES": np.array( branches ) }
+  for i, branch in enumerate( branches ):
+    arrays[ "SEEK{}".format(i) ] = np.array( [ seek for seek, nBytes in baskets[ branch ] ], dtype = np.int64 )
+    arrays[ "BYTES{}".format(i) ] = np.array( [ nBytes for seek, nBytes in baskets[ branch ] ], dtype = np.int64 )
+  write_npz( path, arrays )
+
+class Prefetcher( object ):
+  def __init__( self, tasks, locate, depth, capBytes, tailBytes = 1 << 23, blockSize = 1 << 22 ):
+    self.tasks = tasks          # input files of each task, in the order the tasks run
+    self.locate = locate
+    self.depth = depth          # tasks warmed ahead of the current one
+    self.capBytes = capBytes    # bytes read ahead of the current task, shared by the tasks in flight
+    self.tailBytes = tailBytes  # bytes read from the end of each ROOT file
+    self.blockSize = blockSize
+    self.current = -1
+    self.queued = 0
+    self.selected = {}          # task -> branches whose byte ranges are queued
+    self.spent = {}             # task -> bytes read, only used by the thread
+    self.queue = queue.Queue()
+    self.thread = threading.Thread( target = self.run )
+    self.thread.daemon = True
+    self.thread.start()
+
+  def advance( self, i ):
+    # called when task i starts, queues the tails of the files of the next depth tasks
+    self.current = i
+    self.queued = max( self.queued, i + 1 )
+    while self.queued < min( i + 1 + self.depth, len( self.tasks ) ):
+      self.queue.put( ( self.queued, None ) )
+      self.queued += 1
+
+  def select( self, branches ):
+    # called once the current task knows the branches it reads, queues the ones not yet queued for the next tasks
+    for i in range( self.current + 1, self.queued ):
+      added = set( branches ) - self.selected.get( i, set() )
+      if not added: continue
+      self.selected[i] = self.selected.get( i, set() ) | added
+      self.queue.put( ( i, added ) )
+
+  def reads( self, i, branches ):
+    # the tails of the ROOT files of task i without branches, otherwise the ranges of the branches
+    if branches is None: return [ ( path, [ ( -self.tailBytes, self.tailBytes ) ] ) for path in self.tasks[i] if path.endswith( ".root" ) ]
+    try:
+      return [ read for path in self.tasks[i] for read in self.locate( path, branches ) ]
+    except ( IOError, OSError ):
+      return []
+
+  def run( self ):
+    while True:
+      item = self.queue.get()
+      if item is None: return
+      i, branches = item
+      if i <= self.current: continue # its files are already being read by the task itself
+      for path, ranges in self.reads( i, branches ):
+        if i <= self.current: break
+        budget = self.capBytes // max( self.depth, 1 ) - self.spent.get( i, 0 )
+        if budget <= 0: break
+        self.spent[i] = self.spent.get( i, 0 ) + self.warm( path, ranges, budget )
+
+  def warm( self, path, ranges, nBytes ):
+    # reads the ranges of path in file order, adjacent ranges in one pass, negative offsets count from the end of the file
+    read = 0
+    try:
+      size = os.path.getsize( path )
+      if ranges is None: ranges = [ ( 0, size ) ]
+      ranges = sorted( ( max( offset + size if offset < 0 else offset, 0 ), length ) for offset, length in ranges )
+      merged = []
+      for offset, length in ranges:
+        if merged and offset <= merged[-1][1]: merged[-1][1] = max( merged[-1][1], offset + length )
+        else: merged.append( [ offset, offset + length ] )
+      with open( path, "rb" ) as warmFile:
+        for start, stop in merged:
+          warmFile.seek( start )
+          while start < stop and read < nBytes:
+            block = warmFile.read( min( self.blockSize, stop - start, nBytes - read ) )
+            if not block: break
+            start += len( block )
+            read += len( block )
+          if read >= nBytes: break
+    except ( IOError, OSError ):
+      pass
+    return read
+
+  def close( self ):
+    self.queue.put( None )
+    self.thread.join()
@@ -0,0 +1,188 @@
+#!/usr/bin/python
+
+import os, hashlib
+import numpy as np
+from expressions import operations
+
+# persistent selection masks so the cuts of a sample and category are evaluated once and reused by every variable
+
+def selection_key( samplePath, cuts ):
+  # changes when the input file is replaced or any of the cut strings changes
+  stat = os.stat( samplePath )
+  key = hashlib.sha1()
+  key.update( "{}:{}:{}".format( os.path.abspath( samplePath ), stat.st_size, int( stat.st_mtime ) ).encode( "utf-8" ) )
+  for cut in sorted( cuts ): key.update( ( "\n" + cut ).encode( "utf-8" ) )
+  return key.hexdigest()
+
+def selection_path( cacheDir, samplePath, cuts, tag = "" ):
+  shift = os.path.basename( os.path.dirname( os.path.abspath( samplePath ) ) ) # nominal, JECup, ...
+  sample = os.path.basename( samplePath ).replace( ".root", "" ) + ( "_" + tag if tag else "" )
+  return os.path.join( cacheDir, shift, "{}_{}.npz".format( sample, selection_key( samplePath, cuts )[:16] ) )
+
+def write_npz( path, arrays ):
+  if not os.path.exists( os.path.dirname( path ) ): os.system( "mkdir -p {}".format( os.path.dirname( path ) ) )
+  tmpPath = "{}.{}.tmp".format( path, os.getpid() ) # written aside and renamed so concurrent jobs never read a partial file
+  with open( tmpPath, "wb" ) as cacheFile:
+    np.savez_compressed( cacheFile, **arrays )
+  os.rename( tmpPath, path )
+
+def save_selection( path, nEntries, entries, masks ):
+  # entries passing any cut are packed over the whole tree, each cut is packed over those entries
+  union = np.zeros( nEntries, dtype = bool )
+  union[ entries ] = True
+  cuts = sorted( masks )
+  arrays = {
+    "ENTRIES": np.array( [ nEntries ], dtype = np.int64 ),
+    "UNION": np.packbits( union ),
+    "CUTS": np.array( cuts )
+  }
+  for i, cut in enumerate( cuts ): arrays[ "CUT{}".format(i) ] = np.packbits( masks[ cut ] )
+  write_npz( path, arrays )
+
+def load_selection( path, nEntries, cuts ):
+  # returns the selected entry numbers and the mask of each cut over them, None if there is no valid cache
+  if not os.path.exists( path ): return None
+  cache = np.load( path )
+  try:
+    stored = [ str( cut ) for cut in cache[ "CUTS" ] ]
+    if int( cache[ "ENTRIES" ][0] ) != nEntries or stored != sorted( cuts ): return None
+    entries = np.flatnonzero( np.unpackbits( cache[ "UNION" ] )[ :nEntries ] )
+    masks = { cut: np.unpackbits( cache[ "CUT{}".format(i) ] )[ :len( entries ) ].astype( bool ) for i, cut in enumerate( stored ) }
+  except ( IOError, KeyError, ValueError ):
+    print( "[WARN] Ignoring unreadable selection cache {}".format( path ) )
+    return None
+  finally:
+    cache.close()
+  return entries, masks
+
+def save_entries( path, nEntries, entries ):
+  # entry list of a single cut, i.e. the config.base_cut skim
+  passed = np.zeros( nEntries, dtype = bool )
+  passed[ entries ] = True
+  write_npz( path, { "ENTRIES": np.array( [ nEntries ], dtype = np.int64 ), "PASSED": np.packbits( passed ) } )
+
+def load_entries( path, nEntries ):
+  if not os.path.exists( path ): return None
+  cache = np.load( path )
+  try:
+    if int( cache[ "ENTRIES" ][0] ) != nEntries: return None
+    entries = np.flatnonzero( np.unpackbits( cache[ "PASSED" ] )[ :nEntries ] )
+  except ( IOError, KeyError, ValueError ):
+    print( "[WARN] Ignoring unreadable entry list {}".format( path ) )
+    return None
+  finally:
+    cache.close()
+  return entries
+
+def preview_mask( events, fraction ):
+  # keeps a reproducible fraction of the events from a hash of the event number, so the nominal and shifted trees agree
+  hashed = np.asarray( events ).astype( np.uint64 )
+  with np.errstate( over = "ignore" ): # splitmix64 finalizer
+    hashed = ( hashed ^ ( hashed >> np.uint64( 30 ) ) ) * np.uint64( 0xbf58476d1ce4e5b9 )
+    hashed = ( hashed ^ ( hashed >> np.uint64( 27 ) ) ) * np.uint64( 0x94d049bb133111eb )
+    hashed = hashed ^ ( hashed >> np.uint64( 31 ) )
+  return ( hashed >> np.uint64( 11 ) ).astype( np.float64 ) / 2.**53 < fraction
+
+class BitmapIndex( object ):
+  # one packed bitmap per distinct value of each low-cardinality column, over the entries passing the base cut
+  def __init__( self, nEntries, entries, bitmaps ):
+    self.nEntries = nEntries
+    self.entries = entries # entry numbers passing the base cut
+    self.bitmaps = bitmaps # column -> ( distinct values, packed bitmaps [ value x entry ] )
+
+  @classmethod
+  def build( cls, nEntries, entries, columns, maxValues = 64 ):
+    bitmaps = {}
+    for column in columns:
+      values = np.broadcast_to( np.asarray( columns[ column ], dtype = np.float64 ), entries.shape )
+      distinct = np.unique( values[ ~np.isnan( values ) ] )
+      if len( distinct ) > maxValues: continue
+      bitmaps[ column ] = ( distinct, np.packbits( values[ None, : ] == distinct[ :, None ], axis = 1 ) )
+    return cls( nEntries, entries, bitmaps )
+
+  def packed( self, column, op, value ):
+    # packed bitmap of the entries where "column op value" holds, None if the column is not indexed
+    if column not in self.bitmaps: return None
+    distinct, bitmaps = self.bitmaps[ column ]
+    matched = operations[ op ]( distinct, value )
+    if not matched.any(): return np.zeros( bitmaps.shape[1], dtype = np.uint8 )
+    return np.bitwise_or.reduce( bitmaps[ matched ], axis = 0 )
+
+  def unpack( self, packed ):
+    return np.unpackbits( packed )[ :len( self.entries ) ].astype( bool )
+
+  def save( self, path ):
+    universe = np.zeros( self.nEntries, dtype = bool )
+    universe[ self.entries ] = True
+    columns = sorted( self.bitmaps )
+    arrays = {
+      "ENTRIES": np.array( [ self.nEntries ], dtype = np.int64 ),
+      "UNIVERSE": np.packbits( universe ),
+      "COLUMNS": np.array( columns )
+    }
+    for i, column in enumerate( columns ):
+      arrays[ "VALUES{}".format(i) ], arrays[ "BITMAPS{}".format(i) ] = self.bitmaps[ column ]
+    write_npz( path, arrays )
+
+  @classmethod
+  def load( cls, path, nEntries ):
+    if not os.path.exists( path ): return None
+    cache = np.load( path )
+    try:
+      if int( cache[ "ENTRIES" ][0] ) != nEntries: return None
+      entries = np.flatnonzero( np.unpackbits( cache[ "UNIVERSE" ] )[ :nEntries ] )
+      bitmaps = { str( column ): ( cache[ "VALUES{}".format(i) ], cache[ "BITMAPS{}".format(i) ] ) for i, column in enumerate( cache[ "COLUMNS" ] ) }
+    except ( IOError, KeyError, ValueError ):
+      print( "[WARN] Ignoring unreadable bitmap index {}".format( path ) )
+      return None
+    finally:
+      cache.close()
+    return cls( nEntries, entries, bitmaps )
+
+class CategoryCube( object ):
+  # cells of the category columns ( nJ x nB x nHOT x nT x nW x lepton ) shared by the categories of a region
+  # slots 0 to cap - 1 of an axis hold the value, cap holds every larger value ( the "p" categories ) and cap + 1 negative or missing values
+  # the exclusive lepton flags share one axis with a slot per combination of flags
+  def __init__( self, clauseLists, flagColumns = [ "isElectron", "isMuon" ] ):
+    # clauseLists = category clauses ( column, op, value ) of every category, with integer values and op in ==, >=, >
+    clauses = [ clause for clauseList in clauseLists for clause in clauseList ]
+    axes = sorted( set( clause[0] for clause in clauses ) )
+    self.flags = [ axis for axis in flagColumns if axis in axes and all( clause[1] == "==" and clause[2] == 1 for clause in clauses if clause[0] == axis ) ]
+    self.axes = [ axis for axis in axes if axis not in self.flags ]
+    self.caps = [ int( max( clause[2] for clause in clauses if clause[0] == axis ) ) + 1 for axis in self.axes ]
+    self.shape = [ cap + 2 for cap in self.caps ] + ( [ 2**len( self.flags ) ] if self.flags else [] )
+
+  def cells( self, compiler, columns, cache, nEvents ):
+    # flat cell of every event, None if an axis has a value that is not an integer count
+    cells = np.zeros( nEvents, dtype = np.int64 )
+    for axis, cap in zip( self.axes, self.caps ):
+      values = np.broadcast_to( np.asarray( compiler.evaluate( [ axis ], columns, cache )[ axis ], dtype = np.float64 ), ( nEvents, ) )
+      valid = values >= 0
+      if not np.all( values[ valid ] == np.floor( values[ valid ] ) ): return None
+      cells = cells * ( cap + 2 ) + np.where( valid, np.minimum( values, cap ), cap + 1 ).astype( np.int64 )
+    if self.flags:
+      lepton = np.zeros( nEvents, dtype = np.int64 )
+      for i, flag in enumerate( self.flags ):
+        lepton += np.broadcast_to( np.asarray( compiler.evaluate( [ flag ], columns, cache )[ flag ] ) == 1, ( nEvents, ) ).astype( np.int64 ) << i
+      cells = cells * 2**len( self.flags ) + lepton
+    return cells
+
+  def slots( self, clauses ):
+    # slots of every axis passing the clauses of one category, an axis it does not cut on keeps every slot
+    slots = []
+    for axis, cap in zip( self.axes, self.caps ):
+      passed = np.ones( cap + 2, dtype = bool )
+      for column, op, value in clauses:
+        if column == axis: passed &= np.append( operations[ op ]( np.arange( cap + 1 ), value ), False )
+      slots.append( passed )
+    if self.flags:
+      passed = np.ones( 2**len( self.flags ), dtype = bool )
+      for column, op, value in clauses:
+        if column in self.flags: passed &= ( ( np.arange( 2**len( self.flags ) ) >> self.flags.index( column ) ) & 1 ) == 1
+      slots.append( passed )
+    return slots
+
+  def select( self, array, clauses ):
+    # sum of array [ cell axes x ... ] over the cells passing the clauses of one category
+    for passed in self.slots( clauses ): array = array.compress( passed, axis = 0 ).sum( axis = 0 )
+    return array
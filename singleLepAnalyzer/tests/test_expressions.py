@@ -0,0 +1,86 @@
+import os, sys
+import numpy as np
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), ".." ) )
+
+from expressions import Compiler, Jagged
+
+def make_columns( nEvents = 200 ):
+  rng = np.random.RandomState( 5 )
+  counts = rng.randint( 0, 5, nEvents )
+  return {
+    "a": rng.uniform( -2, 2, nEvents ),
+    "b": rng.uniform( -2, 2, nEvents ),
+    "c": rng.randint( 0, 3, nEvents ).astype( np.float64 ),
+    "jets": Jagged( counts, rng.uniform( 0, 100, counts.sum() ) ),
+    "shifts": Jagged( np.full( nEvents, 4 ), rng.uniform( 0, 10, 4 * nEvents ) )
+  }
+
+def evaluate( expression, columns ):
+  return Compiler().evaluate( [ expression ], columns )[ expression ]
+
+def test_operator_precedence():
+  columns = make_columns()
+  a, b, c = columns[ "a" ], columns[ "b" ], columns[ "c" ]
+  assert np.allclose( evaluate( "a + b * c", columns ), a + b * c )
+  assert np.allclose( evaluate( "a - b - c", columns ), ( a - b ) - c )
+  assert np.allclose( evaluate( "a / b / 2", columns ), ( a / b ) / 2 )
+  assert np.allclose( evaluate( "-a * b", columns ), -a * b )
+  assert np.allclose( evaluate( "( a + b ) * c", columns ), ( a + b ) * c )
+  assert np.array_equal( evaluate( "a > 0 && b > 0 || c == 2", columns ), ( ( a > 0 ) & ( b > 0 ) ) | ( c == 2 ) )
+  assert np.array_equal( evaluate( "a > 0 || b > 0 && c == 2", columns ), ( a > 0 ) | ( ( b > 0 ) & ( c == 2 ) ) )
+  assert np.array_equal( evaluate( "!( a > 0 ) && c + 1 >= 2", columns ), ( a <= 0 ) & ( c + 1 >= 2 ) )
+  assert np.allclose( evaluate( "( a > 0 ) * 2 + 1", columns ), ( a > 0 ) * 2. + 1 )
+
+def test_division_by_zero_is_zero():
+  columns = make_columns()
+  expected = np.where( columns[ "c" ] != 0, columns[ "a" ] / np.where( columns[ "c" ] != 0, columns[ "c" ], 1 ), 0 )
+  assert np.allclose( evaluate( "a / c", columns ), expected )
+
+def test_index():
+  columns = make_columns()
+  jets = columns[ "jets" ]
+  for i in range( 5 ):
+    expected = np.array( [ jets.content[ start + i ] if count > i else np.nan for start, count in zip( jets.starts, jets.counts ) ] )
+    assert np.array_equal( evaluate( "jets[{}]".format(i), columns ), expected, equal_nan = True )
+  shifts = columns[ "shifts" ].content.reshape( -1, 4 )
+  assert np.array_equal( evaluate( "shifts[2]", columns ), shifts[ :, 2 ] )
+  assert np.all( np.isnan( evaluate( "shifts[4]", columns ) ) )
+
+def test_collections():
+  columns = make_columns()
+  jets = columns[ "jets" ]
+  perEvent = [ jets.content[ start : start + count ] for start, count in zip( jets.starts, jets.counts ) ]
+  assert np.array_equal( evaluate( "Length$(jets)", columns ), jets.counts )
+  assert np.allclose( evaluate( "Sum$(jets)", columns ), [ values.sum() for values in perEvent ] )
+  assert np.allclose( evaluate( "Sum$(jets > 50)", columns ), [ ( values > 50 ).sum() for values in perEvent ] )
+  assert np.allclose( evaluate( "Sum$(jets * a)", columns ), [ ( values * a ).sum() for values, a in zip( perEvent, columns[ "a" ] ) ] )
+  # elementwise operations broadcast the per-event values to every element
+  scaled = evaluate( "jets * a + 1", columns )
+  assert np.array_equal( scaled.counts, jets.counts )
+  assert np.allclose( scaled.content, jets.content * np.repeat( columns[ "a" ], jets.counts ) + 1 )
+
+def test_common_subexpressions():
+  compiler = Compiler()
+  assert compiler.compile( "a * b" ) == compiler.compile( "b * a" )
+  assert compiler.compile( "( a * b ) + c" ) == compiler.compile( "c + a * b" )
+  assert compiler.compile( "a - b" ) != compiler.compile( "b - a" )
+  expressions = [ "a * b + 1", "a * b > 0 && c == 1", "c == 1 && jets[0] > 20" ]
+  cache = {}
+  columns = make_columns()
+  values = compiler.evaluate( expressions, columns, cache )
+  # every distinct node is evaluated once and shared by the expressions using it
+  assert len( cache ) == len( set( node for expression in expressions for node in nodes( compiler, compiler.compile( expression ) ) ) )
+  product = cache[ compiler.compile( "a * b" ) ]
+  assert np.allclose( values[ "a * b + 1" ], product + 1 )
+  assert compiler.evaluate( [ "b * a" ], columns, cache )[ "b * a" ] is product
+
+def nodes( compiler, id_ ):
+  found = set( [ id_ ] )
+  for child in compiler.children( id_ ): found |= nodes( compiler, child )
+  return found
+
+def test_conjuncts_and_comparisons():
+  compiler = Compiler()
+  clauses = compiler.conjuncts( "a > 0 && NJets >= 4 && ( 2 == NB && shifts[1] > 3 )" )
+  assert sorted( compiler.comparison( clause ) for clause in clauses if compiler.comparison( clause ) is not None ) == [ ( "NB", "==", 2. ), ( "NJets", ">=", 4. ), ( "a", ">", 0. ), ( "shifts[1]", ">", 3. ) ]
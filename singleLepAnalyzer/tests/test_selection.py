@@ -0,0 +1,84 @@
+import os, sys
+import numpy as np
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), ".." ) )
+
+from expressions import Compiler
+from selection import BitmapIndex, CategoryCube
+
+def make_columns( nEvents = 2000 ):
+  rng = np.random.RandomState( 3 )
+  isElectron = rng.randint( 0, 2, nEvents ).astype( np.float64 )
+  columns = {
+    "isElectron": isElectron,
+    "isMuon": 1 - isElectron,
+    "NJ": rng.randint( 3, 11, nEvents ).astype( np.float64 ),
+    "NB": rng.randint( -1, 6, nEvents ).astype( np.float64 ), # -1 as a missing value
+    "NW": rng.randint( 0, 3, nEvents ).astype( np.float64 )
+  }
+  columns[ "isMuon" ][ :20 ] = 1 # both flags set
+  return columns
+
+def clause_string( clauses ):
+  return " && ".join( "{} {} {}".format( column, op, value ) for column, op, value in clauses )
+
+categories = [
+  [ ( "isElectron", "==", 1 ), ( "NJ", ">=", 4 ), ( "NB", "==", 2 ) ],
+  [ ( "isMuon", "==", 1 ), ( "NJ", "==", 5 ), ( "NB", ">=", 3 ) ],
+  [ ( "isElectron", "==", 1 ), ( "NJ", ">=", 7 ), ( "NB", ">", 0 ), ( "NW", "==", 0 ) ],
+  [ ( "isMuon", "==", 1 ), ( "NJ", ">=", 4 ), ( "NW", ">=", 1 ) ],
+  [ ( "NJ", "==", 3 ), ( "NB", "==", 0 ) ]
+]
+
+def test_cube_cells_match_the_category_cuts():
+  compiler = Compiler()
+  columns = make_columns()
+  nEvents = len( columns[ "NJ" ] )
+  cube = CategoryCube( categories )
+  assert cube.flags == [ "isElectron", "isMuon" ]
+  assert cube.axes == [ "NB", "NJ", "NW" ]
+  assert cube.shape == [ 4 + 2, 8 + 2, 2 + 2, 4 ] # caps one above the largest value, two flags
+  cells = cube.cells( compiler, columns, {}, nEvents )
+  index = np.unravel_index( cells, cube.shape )
+  for clauses in categories:
+    passed = np.ones( nEvents, dtype = bool )
+    for slots, slot in zip( cube.slots( clauses ), index ): passed &= slots[ slot ]
+    expected = compiler.evaluate( [ clause_string( clauses ) ], columns )[ clause_string( clauses ) ]
+    assert np.array_equal( passed, expected )
+
+def test_cube_select_sums_the_category_cells():
+  compiler = Compiler()
+  columns = make_columns()
+  nEvents = len( columns[ "NJ" ] )
+  weights = np.random.RandomState( 4 ).uniform( 0, 2, nEvents )
+  cube = CategoryCube( categories )
+  cells = cube.cells( compiler, columns, {}, nEvents )
+  sums = np.bincount( cells, weights = weights, minlength = int( np.prod( cube.shape ) ) ).reshape( cube.shape )
+  for clauses in categories:
+    expected = compiler.evaluate( [ clause_string( clauses ) ], columns )[ clause_string( clauses ) ]
+    assert np.isclose( cube.select( sums, clauses ), weights[ expected ].sum() )
+
+def test_cube_keeps_lepton_flags_as_axes_for_other_comparisons():
+  cube = CategoryCube( [ [ ( "isElectron", "==", 1 ) ], [ ( "isElectron", "==", 0 ), ( "isMuon", "==", 1 ) ] ] )
+  assert cube.flags == [ "isMuon" ]
+  assert cube.axes == [ "isElectron" ]
+
+def test_cube_rejects_non_integer_axes():
+  columns = { "NJ": np.array( [ 4., 5.5 ] ) }
+  assert CategoryCube( [ [ ( "NJ", ">=", 4 ) ] ] ).cells( Compiler(), columns, {}, 2 ) is None
+
+def test_bitmap_index( tmpdir ):
+  columns = make_columns()
+  nEntries = 3 * len( columns[ "NJ" ] )
+  entries = np.sort( np.random.RandomState( 6 ).choice( nEntries, len( columns[ "NJ" ] ), replace = False ) )
+  index = BitmapIndex.build( nEntries, entries, columns )
+  path = str( tmpdir.join( "index.npz" ) )
+  index.save( path )
+  loaded = BitmapIndex.load( path, nEntries )
+  assert np.array_equal( loaded.entries, entries )
+  assert BitmapIndex.load( path, nEntries + 1 ) is None
+  for column, op, value in [ ( "NJ", "==", 5 ), ( "NJ", ">=", 7 ), ( "NB", ">", 0 ), ( "NB", "==", 9 ), ( "NW", "<", 1 ), ( "isElectron", "!=", 1 ) ]:
+    expected = Compiler().evaluate( [ clause_string( [ ( column, op, value ) ] ) ], columns )[ clause_string( [ ( column, op, value ) ] ) ]
+    for bitmaps in [ index, loaded ]:
+      assert np.array_equal( bitmaps.unpack( bitmaps.packed( column, op, value ) ), expected )
+  assert index.packed( "missing", "==", 1 ) is None
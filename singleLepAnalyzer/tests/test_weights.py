@@ -0,0 +1,54 @@
+import os, sys
+import numpy as np
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), ".." ) )
+
+from expressions import Compiler, Jagged
+from weights import weight_ratio, shifted_weight, shift_weights
+
+nominal = "genWeight * pileupWeight * btagDeepJetWeight * ( renormWeights[1] > 0 )"
+factors = [ ( "pileupWeight", "pileupWeightUp" ), ( "btagDeepJetWeight", "btagDeepJetWeight_lfup" ) ]
+
+def make_columns( nEvents = 1000 ):
+  rng = np.random.RandomState( 11 )
+  columns = {
+    "genWeight": rng.choice( [ -1., 1. ], nEvents ),
+    "pileupWeight": rng.uniform( 0.5, 1.5, nEvents ),
+    "pileupWeightUp": rng.uniform( 0.5, 1.5, nEvents ),
+    "btagDeepJetWeight": rng.uniform( 0.5, 1.5, nEvents ),
+    "btagDeepJetWeight_lfup": rng.uniform( 0.5, 1.5, nEvents ),
+  }
+  # nominal factors of 0 with non-zero shifted factors, and the other way around
+  columns[ "pileupWeight" ][ : 100 ] = 0
+  columns[ "btagDeepJetWeight" ][ 50 : 150 ] = 0
+  columns[ "pileupWeightUp" ][ 200 : 250 ] = 0
+  counts = rng.randint( 0, 4, nEvents )
+  columns[ "renormWeights" ] = Jagged( counts, rng.uniform( -1, 1, counts.sum() ) )
+  return columns
+
+def ratio_path( compiler, columns, multiplier, shifted ):
+  values = compiler.evaluate( [ nominal, multiplier ], columns )
+  weights = np.array( values[ nominal ], dtype = np.float64 )
+  return shift_weights( compiler, columns, weights, values[ multiplier ], shifted )
+
+def test_shifted_weight_substitutes_factors():
+  assert shifted_weight( nominal, factors ) == "genWeight * pileupWeightUp * btagDeepJetWeight_lfup * ( renormWeights[1] > 0 )"
+  assert shifted_weight( "pileupWeightUp * pileupWeight", factors[ :1 ] ) == "pileupWeightUp * pileupWeightUp"
+
+def test_ratio_matches_direct_product():
+  compiler = Compiler()
+  columns = make_columns()
+  shifted = shifted_weight( nominal, factors )
+  direct = np.asarray( compiler.evaluate( [ shifted ], columns )[ shifted ], dtype = np.float64 )
+  weights = ratio_path( compiler, columns, weight_ratio( nominal, factors ), shifted )
+  assert np.any( direct[ : 150 ] != 0 )
+  assert np.allclose( weights, direct, rtol = 1e-12, atol = 0 )
+
+def test_ratio_alone_drops_zero_nominal_factors():
+  compiler = Compiler()
+  columns = make_columns()
+  shifted = shifted_weight( nominal, factors )
+  direct = np.asarray( compiler.evaluate( [ shifted ], columns )[ shifted ], dtype = np.float64 )
+  weights = ratio_path( compiler, columns, weight_ratio( nominal, factors ), None )
+  assert np.all( weights[ : 150 ] == 0 )
+  assert np.allclose( weights[ 150 : ], direct[ 150 : ], rtol = 1e-12, atol = 0 )
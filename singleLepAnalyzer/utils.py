@@ -1,7 +1,8 @@
 #!/usr/bin/python
 
-import sys,math
+import os,sys,math,json,itertools
 import numpy as np
+from array import array
 import config
 from ROOT import *
 
@@ -11,6 +12,38 @@ def contains_category( category, categories ):
       return False
   return True
 
+def region_categories( region ):
+  # ( LEPTON, NHOT, NT, NW, NB, NJ ) bins of a region that are topologically possible
+  bins = config.hist_bins[ "VR" if region in [ "TTCR", "WJCR" ] else region ]
+  categories = []
+  for category in itertools.product( bins[ "LEPTON" ], bins[ "NHOT" ], bins[ "NT" ], bins[ "NW" ], bins[ "NB" ], bins[ "NJ" ] ):
+    if ( int( category[1][0] ) + int( category[2][0] ) + int( category[3][0] ) + int( category[4][0] ) ) > int( category[5][0] ): continue
+    categories.append( category )
+  return categories
+
+def sample_paths( samples, year, group, nominal = False ):
+  # ljmet files of a group for the nominal and the JEC and JER shifted trees
+  inputDir = config.siginputDir[ year ] if group == "SIG" else config.inputDir[ year ]
+  shifts = [ "nominal" ]
+  if group != "DAT" and not nominal:
+    for shift in [ "up", "down" ]:
+      if config.systematics[ "MC" ][ "JEC" ][0]:
+        for systJEC in config.systematics[ "REDUCED JEC" ]:
+          if not config.systematics[ "REDUCED JEC" ][ systJEC ]: continue
+          shifts.append( "JEC" + shift if systJEC == "Total" else systJEC.replace( "Era", "20" + year ).replace( "APV", "" ) + shift )
+      if config.systematics[ "MC" ][ "JER" ][0]: shifts.append( "JER" + shift )
+  return [ os.path.join( inputDir, shift, samples.samples[ group ][ process ] + "_hadd.root" ) for shift in shifts for process in sorted( samples.samples[ group ] ) ]
+
+def sample_manifest_path( year ):
+  return os.path.join( config.cacheDir[ year ], "samples.json" )
+
+def load_sample_manifest( year ):
+  # { path: { EXISTS, SIZE, MTIME, ENTRIES, PASSED } } written by makeTemplates/build_manifest.py, empty if it was not run
+  manifestPath = sample_manifest_path( year )
+  if not os.path.exists( manifestPath ): return {}
+  with open( manifestPath ) as manifestFile:
+    return json.load( manifestFile )
+
 def hist_parse( hist_name, samples ):
   parse = {
     "PROCESS": "",    # mostly used in templates.py to associate to Combine group
@@ -75,3 +108,21 @@ def hist_tag( *args ):
   histTag = args[0]
   for arg in args[1:]: histTag += "_{}".format( arg )
   return histTag
+
+def rebin_edges( hist, edges, name = "" ):
+  # sums the bins of hist into the given edges, an edge falling inside a bin of hist is moved to the nearest bin edge
+  # without a name hist itself is rebinned, as with TH1::Rebin
+  axis = hist.GetXaxis()
+  histEdges = np.array( [ axis.GetBinLowEdge( i ) for i in range( 1, hist.GetNbinsX() + 2 ) ] )
+  snapped = sorted( set( histEdges[ np.abs( histEdges - edge ).argmin() ] for edge in edges ) )
+  return hist.Rebin( len( snapped ) - 1, name, array( "d", snapped ) )
+
+def pdf_replicas( hist ):
+  # unpack the [ bin x replica ] PDF histogram from hists.py into one histogram per replica, <hist name><i>
+  replicas = []
+  for i in range( hist.GetNbinsY() ):
+    replica = hist.ProjectionX( "{}{}".format( hist.GetName(), i ), i + 1, i + 1, "e" )
+    replica.SetTitle( hist.GetTitle() )
+    replica.SetDirectory(0)
+    replicas.append( replica )
+  return replicas
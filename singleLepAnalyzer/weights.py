@@ -0,0 +1,36 @@
+#!/usr/bin/python
+
+import re
+import numpy as np
+from expressions import select
+
+# weight systematics rescaling factors of the nominal weight are filled as nominal weight * ( shifted factor / factor )
+# the ratio is undefined where a factor is 0, so events with a nominal weight of 0 take the shifted weight evaluated directly
+
+def factor_regex( factor ):
+  return r"(?<!\w){}(?!\w)".format( re.escape( factor ) )
+
+def weight_ratio( weight, factors ):
+  # express a weight variation as a multiplier of the nominal weight, factors = [ ( nominal branch, shifted branch ) ]
+  ratios = []
+  for factor, shifted in factors:
+    if re.search( factor_regex( factor ), weight ) is None: continue
+    ratios.append( "( {} / {} )".format( shifted, factor ) )
+  return " * ".join( ratios ) if ratios else "1"
+
+def shifted_weight( weight, factors ):
+  # the weight variation itself, with every nominal factor replaced by its shifted branch
+  for factor, shifted in factors:
+    weight = re.sub( factor_regex( factor ), shifted, weight )
+  return weight
+
+def shift_weights( compiler, columns, nominal, multiplier, shifted = None ):
+  # per-event nominal * multiplier, the events with a nominal weight of 0 are evaluated from the shifted weight if given
+  weights = nominal * multiplier
+  if shifted is None: return weights
+  zero = nominal == 0
+  nZero = np.count_nonzero( zero )
+  if nZero == 0: return weights
+  subset = { branch: select( columns[ branch ], zero ) for branch in compiler.branches( [ shifted ] ) }
+  weights[ zero ] = np.broadcast_to( np.asarray( compiler.evaluate( [ shifted ], subset )[ shifted ], dtype = np.float64 ), ( nZero, ) )
+  return weights